@@ -11,6 +11,7 @@ import sys
 import os
 import os.path
 import time
+from time import sleep as _sleep
 
 try:
     from thingflow import *
@@ -30,16 +31,19 @@ class DummySensor:
         self.sensor_id = 1
 
     def sample(self):
-        if self.idx==len(self.value_stream):
+        # StopIteration is the sensor protocol for ending the stream
+        # (SensorAsOutputThing turns it into on_completed), so we keep it.
+        # It is only raised once per stream.
+        idx = self.idx
+        value_stream = self.value_stream
+        if idx==len(value_stream):
             raise StopIteration()
-        else:
-            if self.sample_time > 0:
-                print("Sensor simulating a sample time of %d seconds with a sleep" %
-                      self.sample_time)
-                time.sleep(self.sample_time)
-            val = self.value_stream[self.idx]
-            self.idx += 1
-            return val
+        if self.sample_time > 0:
+            print("Sensor simulating a sample time of %d seconds with a sleep" %
+                  self.sample_time)
+            _sleep(self.sample_time)
+        self.idx = idx + 1
+        return value_stream[idx]
 
     def __str__(self):
         return 'DummySensor'
@@ -50,6 +54,8 @@ class ValidationInputThing:
     Use the test_case for the assertions (for proper error reporting in a unit
     test).
     """
+    __slots__ = ('expected_stream', 'next_idx', 'test_case',
+                 'extract_value_fn', 'completed')
     def __init__(self, expected_stream, test_case,
                  extract_value_fn=lambda event:event[2]):
         self.expected_stream = expected_stream
@@ -60,14 +66,16 @@ class ValidationInputThing:
 
     def on_next(self, x):
         tc = self.test_case
-        tc.assertLess(self.next_idx, len(self.expected_stream),
+        idx = self.next_idx
+        expected_stream = self.expected_stream
+        tc.assertLess(idx, len(expected_stream),
                       "Got an event after reaching the end of the expected stream")
-        expected = self.expected_stream[self.next_idx]
+        expected = expected_stream[idx]
         actual = self.extract_value_fn(x)
         tc.assertEqual(actual, expected,
-                       "Values for element %d of event stream mismatch" % self.next_idx)
+                       "Values for element %d of event stream mismatch" % idx)
         print(x)
-        self.next_idx += 1
+        self.next_idx = idx + 1
 
     def on_completed(self):
         tc = self.test_case
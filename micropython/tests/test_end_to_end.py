@@ -57,6 +57,8 @@ class ValidationInputThing:
     Use the test_case for the assertions (for proper error reporting in a unit
     test).
     """
+    __slots__ = ('expected_stream', 'next_idx', 'test_case',
+                 'extract_value_fn', 'completed')
     def __init__(self, expected_stream, test_case,
                  extract_value_fn=lambda event:event[2]):
         self.expected_stream = expected_stream
@@ -67,13 +69,15 @@ class ValidationInputThing:
 
     def on_next(self, x):
         tc = self.test_case
-        tc.assertLess(self.next_idx, len(self.expected_stream),
+        idx = self.next_idx
+        expected_stream = self.expected_stream
+        tc.assertLess(idx, len(expected_stream),
                       "Got an event after reaching the end of the expected stream")
-        expected = self.expected_stream[self.next_idx]
+        expected = expected_stream[idx]
         actual = self.extract_value_fn(x)
         tc.assertEqual(actual, expected,
-                       "Values for element %d of event stream mismatch" % self.next_idx)
-        self.next_idx += 1
+                       "Values for element %d of event stream mismatch" % idx)
+        self.next_idx = idx + 1
 
     def on_completed(self):
         tc = self.test_case
@@ -92,14 +92,17 @@ class OutputThing:
 
 
 class SensorAsOutputThing(OutputThing):
-    __slots__ = ('sensor')
+    __slots__ = ('sensor', '_sample', '_sensor_id')
     def __init__(self, sensor):
         super().__init__(None)
         self.sensor = sensor
-    def _observe(self):
+        # bind what we need for each sample up front
+        self._sample = sensor.sample
+        self._sensor_id = sensor.sensor_id
+    def _observe(self, time=utime.time):
         try:
-            v = self.sensor.sample()
-            self._dispatch_next((self.sensor.sensor_id, utime.time(), v),)
+            v = self._sample()
+            self._dispatch_next((self._sensor_id, time(), v))
         except FatalError:
             raise
         except StopIteration:
@@ -4,9 +4,13 @@
 """
 
 import asyncio
+import threading
 import unittest
 
-from thingflow.base import Scheduler, SensorAsOutputThing, FunctionFilter
+from thingflow.base import Scheduler, SensorAsOutputThing, FunctionFilter, \
+                           OutputThing, ExcInDispatch, \
+                           DISPATCH_COMPILE_THRESHOLD, \
+                           EventLoopOutputThingMixin
 from utils import ValueListSensor, ValidationInputThing, CaptureInputThing
 from thingflow.filters.where import where
 from thingflow.filters.output import output
@@ -146,9 +150,253 @@ class TestFunctionFilter(unittest.TestCase):
         self.assertEqual([20, 30, 100], ct.events, "Capture thing event mismatch")
         self.assertEqual([20, 30, 100], captured_list_ref[0], "captured_list_ref mismatch")
         print("That's all folks")
-        
 
-    
+
+    def test_function_filter_on_next_selection(self):
+        """The on_next method is chosen when the filter is created. Check the
+        pass-through case and a subclass that overrides on_next().
+        """
+        o = OutputThing()
+        passthrough_capture = CaptureInputThing()
+        FunctionFilter(o, on_completed=lambda self: self._dispatch_completed())\
+            .connect(passthrough_capture)
+        class Doubler(FunctionFilter):
+            def on_next(self, x):
+                super().on_next(2*x)
+        doubled_capture = CaptureInputThing()
+        Doubler(o, on_next=lambda self, x: self._dispatch_next(x+1))\
+            .connect(doubled_capture)
+        for i in range(3):
+            o._dispatch_next(i)
+        o._dispatch_completed()
+        self.assertEqual([0, 1, 2], passthrough_capture.events)
+        self.assertTrue(passthrough_capture.completed)
+        self.assertEqual([1, 3, 5], doubled_capture.events)
+
+
+class TestDispatch(unittest.TestCase):
+    """Check that OutputThing dispatch sees changes to the connections,
+    including those made while dispatching.
+    """
+    def test_connection_changes(self):
+        o = OutputThing()
+        first = CaptureInputThing()
+        second = CaptureInputThing()
+        o.connect(first)
+        o._dispatch_next(1)
+        disconnect_second = o.connect(second)
+        o._dispatch_next(2)
+        disconnect_second()
+        # back to a single connection, which is dispatched without a loop
+        self.assertIn('default', o._fast_next)
+        o._dispatch_next(3)
+        self.assertEqual([1, 2, 3], first.events)
+        self.assertEqual([2], second.events)
+
+    def test_compiled_dispatch(self):
+        """Dispatch enough events that the OutputThing generates its
+        specialized dispatch code, then change the connections.
+        """
+        o = OutputThing()
+        first = CaptureInputThing()
+        second = CaptureInputThing()
+        third = CaptureInputThing()
+        o.connect(first)
+        o.connect(second)
+        n = DISPATCH_COMPILE_THRESHOLD + 10
+        for i in range(n):
+            o._dispatch_next(i)
+        self.assertEqual('<dispatch_next(default)>',
+                         o._fast_next['default'].__code__.co_filename)
+        disconnect_third = o.connect(third)
+        self.assertNotIn('default', o._fast_next)
+        for i in range(n):
+            o._dispatch_next(i)
+        disconnect_third()
+        o._dispatch_next(n)
+        self.assertEqual(list(range(n)) + list(range(n)) + [n], first.events)
+        self.assertEqual(first.events, second.events)
+        self.assertEqual(list(range(n)), third.events)
+
+    def test_compiled_dispatch_invalidated_under_lock(self):
+        """A connect after the dispatch code was generated must wait for
+        _connections_lock before it discards the generated function.
+        """
+        o = OutputThing()
+        o.connect(CaptureInputThing())
+        disconnect_second = o.connect(CaptureInputThing())
+        for i in range(DISPATCH_COMPILE_THRESHOLD):
+            o._dispatch_next(i)
+        compiled = o._fast_next['default']
+        for change in (lambda: o.connect(CaptureInputThing()),
+                       disconnect_second):
+            with o._connections_lock:
+                t = threading.Thread(target=change)
+                t.start()
+                t.join(0.1)
+                self.assertTrue(t.is_alive())
+                self.assertIs(compiled, o._fast_next['default'])
+            t.join()
+            self.assertNotIn('default', o._fast_next)
+            for i in range(DISPATCH_COMPILE_THRESHOLD):
+                o._dispatch_next(i)
+            self.assertIsNot(compiled, o._fast_next['default'])
+            compiled = o._fast_next['default']
+
+    def test_compile_per_port(self):
+        """Each port has its own warm up count before its dispatch code is
+        generated.
+        """
+        o = OutputThing(ports=['a', 'b'])
+        captures = [CaptureInputThing() for i in range(4)]
+        for (i, c) in enumerate(captures):
+            o.connect(c, port_mapping=('a' if i<2 else 'b', 'default'))
+        for i in range(DISPATCH_COMPILE_THRESHOLD):
+            o._dispatch_next(i, port='a')
+        self.assertIn('a', o._fast_next)
+        o._dispatch_next(0, port='b')
+        self.assertNotIn('b', o._fast_next)
+        self.assertEqual(list(range(DISPATCH_COMPILE_THRESHOLD)),
+                         captures[1].events)
+        self.assertEqual([0], captures[3].events)
+
+    def test_enqueue_fn(self):
+        """When the OutputThing has an enqueue function, each connection's
+        on_next call should be passed to it.
+        """
+        o = OutputThing()
+        first = CaptureInputThing()
+        second = CaptureInputThing()
+        o.connect(first)
+        o.connect(second)
+        queued = []
+        o._schedule(lambda fn, *args: queued.append((fn, args)))
+        o._dispatch_next(1)
+        self.assertEqual(2, len(queued))
+        self.assertEqual([], first.events)
+        for (fn, args) in queued:
+            fn(*args)
+        self.assertEqual([1], first.events)
+        self.assertEqual([1], second.events)
+
+    def test_disconnect_in_dispatch(self):
+        o = OutputThing()
+        seen = []
+        disconnects = []
+        def on_next(x):
+            seen.append(x)
+            disconnects[0]()
+        disconnects.append(o.connect(on_next))
+        capture = CaptureInputThing()
+        o.connect(capture)
+        o._dispatch_next(1)
+        o._dispatch_next(2)
+        self.assertEqual([1], seen)
+        self.assertEqual([1, 2], capture.events)
+
+    def test_exc_in_dispatch(self):
+        o = OutputThing()
+        capture = CaptureInputThing()
+        o.connect(capture)
+        def bad_on_next(x):
+            raise ValueError("expected exc")
+        o.connect(bad_on_next)
+        # check both the loop and the generated code
+        o._compile_dispatch('default')
+        for i in range(2):
+            with self.assertRaises(ExcInDispatch) as cm:
+                o._dispatch_next(1)
+            self.assertIn('bad_on_next', str(cm.exception))
+            self.assertIsInstance(cm.exception.__cause__, ValueError)
+            o._fast_next.clear()
+        self.assertEqual([1, 1], capture.events)
+
+
+
+class CountingLoopOutputThing(OutputThing, EventLoopOutputThingMixin):
+    """Private event loop that dispatches a few events and then exits.
+    Records the thread it ran on.
+    """
+    def __init__(self, num_events):
+        super().__init__()
+        self.num_events = num_events
+        self.thread_id = None
+
+    def _observe_event_loop(self):
+        self.thread_id = threading.get_ident()
+        for i in range(self.num_events):
+            self._dispatch_next(i)
+        self._dispatch_completed()
+
+    def _stop_loop(self):
+        pass
+
+
+class SchedulePrivateLoop(OutputThing):
+    """When first called by the scheduler, put another thing on a private
+    loop and cancel our own schedule.
+    """
+    def __init__(self, scheduler, output_thing):
+        super().__init__()
+        self.scheduler = scheduler
+        self.output_thing = output_thing
+        self.cancel_schedule = None
+
+    def _observe(self):
+        self.scheduler.schedule_on_private_event_loop(self.output_thing)
+        self.cancel_schedule()
+
+
+class TestPrivateEventLoop(unittest.TestCase):
+    def test_pool_released(self):
+        """The thread pool should be shut down when the scheduler stops.
+        """
+        scheduler = Scheduler(asyncio.get_event_loop())
+        captures = []
+        for i in range(3):
+            o = CountingLoopOutputThing(3)
+            capture = CaptureInputThing()
+            o.connect(capture)
+            captures.append(capture)
+            scheduler.schedule_on_private_event_loop(o)
+        scheduler.run_forever()
+        for capture in captures:
+            self.assertEqual([0, 1, 2], capture.events)
+            self.assertTrue(capture.completed)
+        self.assertEqual(0, scheduler._private_loops)
+        self.assertIsNone(scheduler._private_loop_pool)
+
+    def test_thread_reused(self):
+        """A loop started after another has exited should run on the same
+        thread.
+        """
+        scheduler = Scheduler(asyncio.get_event_loop())
+        first = CountingLoopOutputThing(1)
+        second = CountingLoopOutputThing(1)
+        scheduler.schedule_on_private_event_loop(first)
+        helper = SchedulePrivateLoop(scheduler, second)
+        helper.cancel_schedule = scheduler.schedule_periodic(helper, 0.5)
+        scheduler.run_forever()
+        self.assertIsNotNone(first.thread_id)
+        self.assertEqual(first.thread_id, second.thread_id)
+        self.assertIsNone(scheduler._private_loop_pool)
+
+    def test_max_private_loops(self):
+        """Loops beyond the limit should wait for a running one to exit.
+        """
+        scheduler = Scheduler(asyncio.get_event_loop(), max_private_loops=1)
+        captures = []
+        for i in range(2):
+            o = CountingLoopOutputThing(2)
+            capture = CaptureInputThing()
+            o.connect(capture)
+            captures.append(capture)
+            scheduler.schedule_on_private_event_loop(o)
+        scheduler.run_forever()
+        for capture in captures:
+            self.assertEqual([0, 1], capture.events)
+            self.assertTrue(capture.completed)
+        self.assertEqual(0, scheduler._private_loops)
 
 if __name__ == '__main__':
     unittest.main()
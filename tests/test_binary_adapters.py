@@ -0,0 +1,52 @@
+# Copyright 2016,2017 by MPI-SWS and Data-Ken Research.
+# Licensed under the Apache 2.0 License.
+"""Verify the binary reader/writer through a round trip
+"""
+
+import unittest
+from tempfile import NamedTemporaryFile
+import os
+import asyncio
+
+from thingflow.base import Scheduler
+from thingflow.adapters.binary import BinarySensorReader
+from utils import make_test_output_thing, CaptureInputThing, \
+    SensorEventValidationInputThing
+
+NUM_EVENTS=5
+
+class TestCases(unittest.TestCase):
+    def _write_and_read(self, records_per_read):
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            sensor = make_test_output_thing(1, stop_after_events=NUM_EVENTS)
+            capture = CaptureInputThing()
+            sensor.connect(capture)
+            sensor.binary_writer(tf.name)
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(sensor)
+            scheduler.run_forever()
+            self.assertTrue(capture.completed, "CaptureInputThing did not complete")
+            self.assertEqual(len(capture.events), NUM_EVENTS,
+                             "number of events captured did not match generated events")
+            reader = BinarySensorReader(tf.name, records_per_read=records_per_read)
+            vs = SensorEventValidationInputThing(capture.events, self)
+            reader.connect(vs)
+            scheduler.schedule_recurring(reader)
+            scheduler.run_forever()
+            self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+        finally:
+            os.remove(tf.name)
+
+    def test_file_write_read(self):
+        self._write_and_read(records_per_read=100)
+
+    def test_partial_blocks(self):
+        """The number of events is not a multiple of the records per read.
+        """
+        self._write_and_read(records_per_read=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -70,6 +70,22 @@ class TestCase(unittest.TestCase):
         scheduler.run_forever()
         print("that's it")
 
+    def test_stop_during_interval(self):
+        """A stop request should not have to wait out the rest of the
+        interval.
+        """
+        o = BlockingOutputThing()
+        scheduler = Scheduler(asyncio.get_event_loop())
+        c = scheduler.schedule_periodic_on_separate_thread(o, 10)
+        vs = ValidationInputThing([1], self, extract_value_fn=lambda v:v)
+        o.connect(vs)
+        o.connect(StopLoopAfter(1, c))
+        start = time.time()
+        scheduler.run_forever()
+        elapsed = time.time() - start
+        self.assertLess(elapsed, 5.0,
+                        "Stopping took %s seconds" % round(elapsed, 2))
+
     def test_blocking_sensor(self):
         s = BlockingSensor(1, stop_after=EVENTS)
         scheduler = Scheduler(asyncio.get_event_loop())
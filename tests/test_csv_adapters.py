@@ -11,11 +11,26 @@ import asyncio
 import datetime
 
 from thingflow.base import Scheduler, IterableAsOutputThing, SensorEvent
-from thingflow.adapters.csv import CsvReader, default_event_mapper
+from thingflow.adapters.csv import CsvReader, default_event_mapper, \
+                                   SensorEventMapping, \
+                                   compact_event_mapper, _format_row, \
+                                   _scan_sensor_events, csv_file_registry
+import io
 import thingflow.filters.dispatch
 from utils import make_test_output_thing, CaptureInputThing, \
     SensorEventValidationInputThing
 
+try:
+    import pandas
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+try:
+    import numpy
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 NUM_EVENTS=5
 
 class TestCases(unittest.TestCase):
@@ -28,6 +43,56 @@ class TestCases(unittest.TestCase):
         self.assertEqual(event2, event,
                          "Round-tripped event does not match original event")
 
+    def test_event_to_line(self):
+        """The direct formatting of events should match the csv writer,
+        and should defer to the csv writer for fields needing quotes.
+        """
+        ts = time.time()
+        for event in [SensorEvent(ts=ts, sensor_id=1, val=123.456),
+                      SensorEvent(ts=int(ts), sensor_id='dining-room', val=-2),
+                      SensorEvent(ts=ts, sensor_id='', val=1e-20)]:
+            self.assertEqual(default_event_mapper.event_to_line(event),
+                             _format_row(default_event_mapper.event_to_row(event)))
+        for event in [SensorEvent(ts=ts, sensor_id='living, room', val=1.0),
+                      SensorEvent(ts=ts, sensor_id=1, val='on'),
+                      SensorEvent(ts=ts, sensor_id=1, val=True)]:
+            self.assertIsNone(default_event_mapper.event_to_line(event))
+
+    def test_scan_sensor_events(self):
+        """Use a tiny chunk size so that rows are split across chunks. The
+        quoted sensor id in the last row should be handled by the csv module.
+        """
+        events = [SensorEvent(ts=1.5, sensor_id=1, val=2.0),
+                  SensorEvent(ts=2.0, sensor_id='dining-room', val=-3.25),
+                  SensorEvent(ts=3.0, sensor_id=2, val=1e-20),
+                  SensorEvent(ts=4.0, sensor_id='living, room', val=4.0)]
+        def to_text(events):
+            return ''.join(_format_row(default_event_mapper.event_to_row(e))
+                           for e in events)
+        unquoted = to_text(events[0:3])
+        for (expected, text) in [(events[0:3], unquoted),
+                                 (events[0:3], unquoted.rstrip()), # no final newline
+                                 (events, to_text(events))]:
+            self.assertEqual(list(_scan_sensor_events(io.StringIO(text, newline=''),
+                                                      chunk_size=7)),
+                             expected)
+        # A quoted row followed by more rows. Every chunk size splits a line
+        # somewhere after the first quote is seen, outside the quoted field.
+        quoted_first = [events[3]] + events[0:3] + [events[3]]
+        text = to_text(quoted_first)
+        for chunk_size in range(1, len(text)+2):
+            self.assertEqual(list(_scan_sensor_events(io.StringIO(text, newline=''),
+                                                      chunk_size=chunk_size)),
+                             quoted_first, "chunk_size=%d" % chunk_size)
+
+    def test_compact_mapper(self):
+        event = SensorEvent(ts=time.time(), sensor_id=1, val=123.456)
+        row = compact_event_mapper.event_to_row(event)
+        self.assertEqual(len(row), 3)
+        self.assertEqual(compact_event_mapper.row_to_event(row), event)
+        self.assertEqual(compact_event_mapper.event_to_line(event),
+                         _format_row(row))
+
     def test_file_write_read(self):
         tf = NamedTemporaryFile(mode='w', delete=False)
         tf.close()
@@ -53,6 +118,233 @@ class TestCases(unittest.TestCase):
         finally:
             os.remove(tf.name)
 
+    def test_subclassed_mapper(self):
+        """A subclass of SensorEventMapping that changes the row format must
+        not have its rows formatted by the inherited event_to_line().
+        """
+        class ValueFirstMapping(SensorEventMapping):
+            def get_header_row(self):
+                return ['value', 'timestamp', 'sensor_id']
+            def event_to_row(self, event):
+                return (event.val, event.ts, event.sensor_id)
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            o = IterableAsOutputThing(iter([SensorEvent(ts=2.0, sensor_id=1,
+                                                        val=3.0)]))
+            o.csv_writer(tf.name, mapper=ValueFirstMapping())
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(o)
+            scheduler.run_forever()
+            with open(tf.name, 'r', newline='') as f:
+                self.assertEqual(f.read(),
+                                 'value,timestamp,sensor_id\r\n3.0,2.0,1\r\n')
+        finally:
+            os.remove(tf.name)
+
+    def test_subclassed_compact_mapper(self):
+        """emit_iso=False must not replace methods defined by a subclass.
+        """
+        class ValueFirstMapping(SensorEventMapping):
+            def __init__(self):
+                super().__init__(emit_iso=False)
+            def event_to_row(self, event):
+                return (event.val, event.ts, event.sensor_id)
+        mapper = ValueFirstMapping()
+        event = SensorEvent(ts=2.0, sensor_id=1, val=3.0)
+        self.assertEqual(mapper.event_to_row(event), (3.0, 2.0, 1))
+        self.assertEqual(compact_event_mapper.event_to_row(event),
+                         (2.0, 1, 3.0))
+
+    def test_subclass_without_super_init(self):
+        """A subclass whose __init__() does not call SensorEventMapping's
+        should still map events with the default format.
+        """
+        class NoSuperInitMapping(SensorEventMapping):
+            def __init__(self):
+                self.extra = 1
+        mapper = NoSuperInitMapping()
+        event = SensorEvent(ts=2.0, sensor_id=1, val=3.0)
+        self.assertEqual(mapper.get_header_row(),
+                         default_event_mapper.get_header_row())
+        row = mapper.event_to_row(event)
+        self.assertEqual(row, default_event_mapper.event_to_row(event))
+        self.assertEqual(mapper.row_to_event(row), event)
+
+    def test_file_write_read_non_ascii(self):
+        """The writers encode to UTF-8 themselves, so check that sensor ids
+        outside of ASCII (including ones needing quotes) round trip.
+        """
+        events = [SensorEvent(ts=1.5, sensor_id='capteur-\xe9', val=1.0),
+                  SensorEvent(ts=2.5, sensor_id='\u6e29\u5ea6,1', val=2.0)]
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            scheduler = Scheduler(asyncio.get_event_loop())
+            src = IterableAsOutputThing(iter(events))
+            src.csv_writer(tf.name)
+            scheduler.schedule_recurring(src)
+            scheduler.run_forever()
+            reader = CsvReader(tf.name)
+            vs = SensorEventValidationInputThing(events, self)
+            reader.connect(vs)
+            scheduler.schedule_recurring(reader)
+            scheduler.run_forever()
+            self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+        finally:
+            os.remove(tf.name)
+
+    def test_emit_iso(self):
+        mapper = SensorEventMapping(emit_iso=False)
+        self.assertEqual(['timestamp', 'sensor_id', 'value'],
+                         mapper.get_header_row())
+        event = SensorEvent(ts=1.5, sensor_id=1, val=2.0)
+        self.assertEqual((1.5, 1, 2.0), mapper.event_to_row(event))
+        self.assertEqual(compact_event_mapper.event_to_line(event),
+                         mapper.event_to_line(event))
+        self.assertEqual(event, mapper.row_to_event(['1.5', '1', '2.0']))
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            scheduler = Scheduler(asyncio.get_event_loop())
+            src = IterableAsOutputThing(iter([event]))
+            src.csv_writer(tf.name, emit_iso=False)
+            scheduler.schedule_recurring(src)
+            scheduler.run_forever()
+            with open(tf.name, 'r', newline='') as f:
+                self.assertEqual('timestamp,sensor_id,value\r\n1.5,1,2.0\r\n',
+                                 f.read())
+        finally:
+            os.remove(tf.name)
+
+    def test_file_write_read_compact(self):
+        for fast in (False, True):
+            tf = NamedTemporaryFile(mode='w', delete=False)
+            tf.close()
+            try:
+                sensor = make_test_output_thing(1, stop_after_events=NUM_EVENTS)
+                capture = CaptureInputThing()
+                sensor.connect(capture)
+                sensor.csv_writer(tf.name, mapper=compact_event_mapper)
+                scheduler = Scheduler(asyncio.get_event_loop())
+                scheduler.schedule_recurring(sensor)
+                scheduler.run_forever()
+                reader = CsvReader(tf.name, mapper=compact_event_mapper,
+                                   fast=fast)
+                vs = SensorEventValidationInputThing(capture.events, self)
+                reader.connect(vs)
+                scheduler.schedule_recurring(reader)
+                scheduler.run_forever()
+                self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+            finally:
+                os.remove(tf.name)
+
+    @unittest.skipUnless(NUMPY_AVAILABLE, "numpy not installed")
+    def test_buffered_csv_writer(self):
+        """Write with the numpy-based writer, using a buffer smaller than the
+        number of events, and read back with both mappers.
+        """
+        for mapper in (default_event_mapper, compact_event_mapper):
+            tf = NamedTemporaryFile(mode='w', delete=False)
+            tf.close()
+            try:
+                sensor = make_test_output_thing(1, stop_after_events=NUM_EVENTS)
+                capture = CaptureInputThing()
+                sensor.connect(capture)
+                sensor.buffered_csv_writer(tf.name, mapper=mapper,
+                                           buffer_events=2)
+                scheduler = Scheduler(asyncio.get_event_loop())
+                scheduler.schedule_recurring(sensor)
+                scheduler.run_forever()
+                reader = CsvReader(tf.name, mapper=mapper)
+                vs = SensorEventValidationInputThing(capture.events, self)
+                reader.connect(vs)
+                scheduler.schedule_recurring(reader)
+                scheduler.run_forever()
+                self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+            finally:
+                os.remove(tf.name)
+
+    def test_file_write_read_batched(self):
+        """Use a batch size that does not divide the number of events, so
+        that the last partial batch must be written when the stream completes.
+        """
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            sensor = make_test_output_thing(1, stop_after_events=NUM_EVENTS)
+            capture = CaptureInputThing()
+            sensor.connect(capture)
+            sensor.csv_writer(tf.name, batch_size=2, flush_every=3)
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(sensor)
+            scheduler.run_forever()
+            self.assertEqual(len(capture.events), NUM_EVENTS,
+                             "number of events captured did not match generated events")
+            reader = CsvReader(tf.name)
+            vs = SensorEventValidationInputThing(capture.events, self)
+            reader.connect(vs)
+            scheduler.schedule_recurring(reader)
+            scheduler.run_forever()
+            self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+        finally:
+            os.remove(tf.name)
+
+    @unittest.skipUnless(PANDAS_AVAILABLE, "pandas not installed")
+    def test_fast_reader(self):
+        """Read back a file with fast=True.
+        """
+        tf = NamedTemporaryFile(mode='w', delete=False)
+        tf.close()
+        try:
+            sensor = make_test_output_thing(1, stop_after_events=NUM_EVENTS)
+            capture = CaptureInputThing()
+            sensor.connect(capture)
+            sensor.csv_writer(tf.name)
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(sensor)
+            scheduler.run_forever()
+            reader = CsvReader(tf.name, fast=True)
+            vs = SensorEventValidationInputThing(capture.events, self)
+            reader.connect(vs)
+            scheduler.schedule_recurring(reader)
+            scheduler.run_forever()
+            self.assertTrue(vs.completed, "ValidationInputThing did not complete")
+        finally:
+            os.remove(tf.name)
+
+    @unittest.skipUnless(PANDAS_AVAILABLE, "pandas not installed")
+    def test_fast_reader_sensor_ids(self):
+        """The fast reader should return the same events as the default
+        reader, including sensor ids that pandas might take for other types.
+        """
+        events = [SensorEvent(ts=1.0, sensor_id='1.5', val=1.0),
+                  SensorEvent(ts=2.0, sensor_id='True', val=2.5),
+                  SensorEvent(ts=3.0, sensor_id='', val=-3.0),
+                  SensorEvent(ts=4.0, sensor_id='NA', val=4.0),
+                  SensorEvent(ts=5.0, sensor_id=7, val=5.0)]
+        for mapper in (default_event_mapper, compact_event_mapper):
+            tf = NamedTemporaryFile(mode='w', delete=False)
+            tf.close()
+            try:
+                scheduler = Scheduler(asyncio.get_event_loop())
+                source = IterableAsOutputThing(iter(events))
+                source.csv_writer(tf.name, mapper=mapper)
+                scheduler.schedule_recurring(source)
+                scheduler.run_forever()
+                results = []
+                for fast in (False, True):
+                    reader = CsvReader(tf.name, mapper=mapper, fast=fast)
+                    capture = CaptureInputThing()
+                    reader.connect(capture)
+                    scheduler.schedule_recurring(reader)
+                    scheduler.run_forever()
+                    results.append(capture.events)
+                self.assertEqual(events, results[0])
+                self.assertEqual(results[0], results[1])
+            finally:
+                os.remove(tf.name)
+
 # data for rollover test
 ROLLING_FILE1 = 'dining-room-2015-01-01.csv'
 ROLLING_FILE2 = 'dining-room-2015-01-02.csv'
@@ -105,6 +397,73 @@ class TestRollingCsvWriter(unittest.TestCase):
             self.assertTrue(os.path.exists(f), 'did not find file %s' % f)
             print("found log file %s" % f)
 
+    def test_late_events(self):
+        """Events that arrive after the day has rolled should still go to the
+        file for their day, whether that file is still open or not.
+        """
+        events = [EVENTS[0], EVENTS[2], EVENTS[1], EVENTS[3]]
+        for max_open_files in (1, 4):
+            self._cleanup()
+            sensor = IterableAsOutputThing(iter(events), name='sensor')
+            sensor.rolling_csv_writer('.', 'dining-room',
+                                      max_open_files=max_open_files)
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(sensor)
+            scheduler.run_forever()
+            for (f, expected) in [(ROLLING_FILE1, EVENTS[0:2]),
+                                  (ROLLING_FILE2, EVENTS[2:4])]:
+                reader = CsvReader(f)
+                vs = SensorEventValidationInputThing(expected, self)
+                reader.connect(vs)
+                scheduler.schedule_recurring(reader)
+                scheduler.run_forever()
+                self.assertTrue(vs.completed,
+                                "ValidationInputThing did not complete for %s" % f)
+
+    def test_custom_get_date(self):
+        """A user-provided get_date function should bypass the day number
+        comparison. Here, we put all the events into the first file.
+        """
+        def generator():
+            for e in EVENTS:
+                yield e
+        sensor = IterableAsOutputThing(generator(), name='sensor')
+        sensor.rolling_csv_writer('.', 'dining-room',
+                                  get_date=lambda e: datetime.date(2015, 1, 1))
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(sensor)
+        scheduler.run_forever()
+        self.assertFalse(os.path.exists(ROLLING_FILE2),
+                         'should not have created %s' % ROLLING_FILE2)
+        with open(ROLLING_FILE1, 'r') as fobj:
+            cnt = len(fobj.readlines())
+        self.assertEqual(len(EVENTS)+1, cnt,
+                         "File %s did not have %d lines" % (ROLLING_FILE1, len(EVENTS)+1))
+
+    def test_shared_files(self):
+        """Two writers with the same base name should share the daily files,
+        which get a single header row, and close them when both are done.
+        """
+        def generator(sensor_id):
+            for e in EVENTS:
+                yield SensorEvent(ts=e.ts, sensor_id=sensor_id, val=e.val)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        for sensor_id in (1, 2):
+            sensor = IterableAsOutputThing(generator(sensor_id),
+                                           name='sensor-%d' % sensor_id)
+            sensor.rolling_csv_writer('.', 'dining-room', batch_size=1)
+            scheduler.schedule_recurring(sensor)
+        scheduler.run_forever()
+        self.assertEqual(0, len(csv_file_registry))
+        lines = []
+        for f in FILES:
+            with open(f, 'r') as fobj:
+                flines = fobj.readlines()
+            self.assertEqual(1, sum(1 for l in flines if l.startswith('timestamp')),
+                             "File %s should have one header row" % f)
+            lines.extend(flines[1:])
+        self.assertEqual(2*len(EVENTS), len(lines))
+
     def test_dispatch(self):
         """Test a scenario where we dispatch to one of several writers
         depending on the sensor id.
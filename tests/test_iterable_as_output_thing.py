@@ -8,10 +8,12 @@ specific IterableAsOutputThing code.
 import asyncio
 import unittest
 
-from thingflow.base import Scheduler, IterableAsOutputThing
-from utils import make_test_output_thing_from_vallist, ValidationInputThing
+from thingflow.base import Scheduler, IterableAsOutputThing, from_func
+from utils import make_test_output_thing_from_vallist, ValidationInputThing, \
+                  CaptureInputThing
 import thingflow.filters.where
 import thingflow.filters.output
+import thingflow.filters.take
 
 value_stream = [
     20,
@@ -83,6 +85,83 @@ class TestIterableAsOutputThing(unittest.TestCase):
         scheduler.schedule_periodic(s, 0.5) # sample twice every second
         s.print_downstream()
         scheduler.run_forever()
+
+    def test_batching(self):
+        """With a batch size that does not evenly divide the stream, we should
+        still get every event, followed by on_completed.
+        """
+        s = IterableAsOutputThing(iter(value_stream), batch_size=3)
+        vo = ValidationInputThing(value_stream, self,
+                                  extract_value_fn=lambda x: x)
+        s.connect(vo)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(s)
+        scheduler.run_forever()
+        self.assertTrue(vo.completed)
+
+    def test_batching_error_handling(self):
+        """Events before the error should be dispatched, followed by the
+        error.
+        """
+        s = IterableAsOutputThing(ErrorIterator(expected_stream), batch_size=2)
+        capture = CaptureInputThing(expecting_error=True)
+        s.connect(capture)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(s)
+        scheduler.run_forever()
+        self.assertEqual(expected_stream, capture.events)
+        self.assertTrue(capture.errored)
+
+    def test_batching_take(self):
+        """Once take() has its events and disconnects, the rest of the
+        batch should be left in the iterator.
+        """
+        it = iter(value_stream)
+        s = IterableAsOutputThing(it, batch_size=5)
+        capture = CaptureInputThing()
+        s.take(2).connect(capture)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(s)
+        scheduler.run_forever()
+        self.assertEqual(value_stream[:2], capture.events)
+        self.assertTrue(capture.completed)
+        self.assertEqual(value_stream[2:], list(it))
+
+    def test_function_iterator_batching(self):
+        """The batch size should not change the sequence generated by
+        from_func().
+        """
+        results = []
+        for batch_size in (1, 4):
+            s = from_func(0, lambda x: x<10, lambda x: x+1, lambda x: x*2,
+                          batch_size=batch_size)
+            capture = CaptureInputThing()
+            s.connect(capture)
+            scheduler = Scheduler(asyncio.get_event_loop())
+            scheduler.schedule_recurring(s)
+            scheduler.run_forever()
+            self.assertTrue(capture.completed)
+            results.append(capture.events)
+        self.assertEqual(results[0], results[1])
+
+    def test_function_iterator_batching_take(self):
+        """Once take() has its events and disconnects, no more states should
+        be computed for the rest of the batch.
+        """
+        states = []
+        def iterate(x):
+            states.append(x+1)
+            return x+1
+        s = from_func(0, lambda x: x<10, iterate, lambda x: x*2,
+                      batch_size=5)
+        capture = CaptureInputThing()
+        s.take(2).connect(capture)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(s)
+        scheduler.run_forever()
+        self.assertEqual([0, 2], capture.events)
+        self.assertTrue(capture.completed)
+        self.assertEqual([1], states)
         
 
 if __name__ == '__main__':
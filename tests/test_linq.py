@@ -65,6 +65,39 @@ class TestLinq(unittest.TestCase):
         scheduler.schedule_recurring(p)
         scheduler.run_forever()
         self.assertTrue(vs.completed)
+
+    def test_take(self):
+        """Test the take() operator
+        """
+        p = make_test_output_thing_from_vallist(1, [1, 2, 3, 4, 5, 6])
+        vs = ValidationInputThing([1, 2, 3], self)
+        p.take(3).connect(vs)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(p)
+        scheduler.run_forever()
+        self.assertTrue(vs.completed)
+
+    def test_take_last(self):
+        """Test the take_last() operator
+        """
+        p = make_test_output_thing_from_vallist(1, [1, 2, 3, 4, 5, 6])
+        vs = ValidationInputThing([4, 5, 6], self)
+        p.take_last(3).connect(vs)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(p)
+        scheduler.run_forever()
+        self.assertTrue(vs.completed)
+
+    def test_last(self):
+        """Test the last() operator
+        """
+        p = make_test_output_thing_from_vallist(1, [1, 2, 3, 4, 5, 6])
+        vs = ValidationInputThing([6], self)
+        p.last().connect(vs)
+        scheduler = Scheduler(asyncio.get_event_loop())
+        scheduler.schedule_recurring(p)
+        scheduler.run_forever()
+        self.assertTrue(vs.completed)
         
         
 if __name__ == '__main__':
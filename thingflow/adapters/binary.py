@@ -0,0 +1,109 @@
+# Copyright 2016,2017 by MPI-SWS and Data-Ken Research.
+# Licensed under the Apache 2.0 License.
+"""Adapters for reading/writing SensorEvent streams to a compact binary file
+format. This avoids the cost of formatting and parsing numbers as text, at
+the cost of a file that is not human-readable. Use the csv adapters if you
+need to look at the data in a spreadsheet.
+
+Each event is stored as a fixed size little-endian record of the timestamp
+(a double), the sensor id (a signed 64-bit integer), and the value (a double).
+There is no header. Sensor ids must be integers.
+"""
+import os
+import struct
+
+from thingflow.base import InputThing, OutputThing, SensorEvent, filtermethod
+from thingflow.adapters.generic import EventRowMapping, DirectReader
+
+SENSOR_EVENT_RECORD = struct.Struct('<dqd')
+
+# Size of the file buffer for the writer and number of records read at a time
+# by the reader.
+DEFAULT_BUFFER_SIZE = 65536
+RECORDS_PER_READ = 4096
+
+
+class BinarySensorEventMapping(EventRowMapping):
+    """Map between a SensorEvent and the (ts, sensor_id, val) tuples
+    packed into records.
+    """
+    def event_to_row(self, event):
+        return (event.ts, event.sensor_id, event.val)
+
+    def row_to_event(self, row):
+        return SensorEvent(ts=row[0], sensor_id=row[1], val=row[2])
+
+binary_event_mapper = BinarySensorEventMapping()
+
+
+class BinarySensorWriter(OutputThing, InputThing):
+    """Write a SensorEvent stream to a binary file. Events are passed on
+    to any downstream connections.
+    """
+    def __init__(self, previous_in_chain, filename,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__()
+        self.filename = filename
+        self.file = open(filename, 'wb', buffering=buffer_size)
+        # bind the methods used for each event up front
+        self._write = self.file.write
+        self._pack = SENSOR_EVENT_RECORD.pack
+        self.dispose = previous_in_chain.connect(self)
+
+    def on_next(self, x):
+        self._write(self._pack(x.ts, x.sensor_id, x.val))
+        self._dispatch_next(x)
+
+    def _close(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def on_completed(self):
+        self._close()
+        self._dispatch_completed()
+
+    def on_error(self, e):
+        self._close()
+        self._dispatch_error(e)
+
+    def __str__(self):
+        return 'binary_writer(%s)' % self.filename
+
+@filtermethod(OutputThing)
+def binary_writer(this, filename, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Write a SensorEvent stream to a binary file. buffer_size is the size
+    of the file's buffer in bytes.
+    """
+    return BinarySensorWriter(this, filename, buffer_size=buffer_size)
+
+
+def _read_records(f, records_per_read):
+    """Generator that reads the file in blocks of records and returns the
+    (ts, sensor_id, val) tuple for each record.
+    """
+    block_size = records_per_read * SENSOR_EVENT_RECORD.size
+    while True:
+        block = f.read(block_size)
+        if not block:
+            return
+        extra = len(block) % SENSOR_EVENT_RECORD.size
+        if extra:
+            raise IOError("Binary sensor event file %s is truncated: %d extra bytes" %
+                          (f.name, extra))
+        yield from SENSOR_EVENT_RECORD.iter_unpack(block)
+
+
+class BinarySensorReader(DirectReader):
+    def __init__(self, filename, records_per_read=RECORDS_PER_READ):
+        """Creates an output_thing that reads SensorEvents from a file written
+        by BinarySensorWriter.
+        """
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        super().__init__(_read_records(self.file, records_per_read),
+                         binary_event_mapper,
+                         name='BinarySensorReader(%s)' % filename)
+
+    def _close(self):
+        self.file.close()
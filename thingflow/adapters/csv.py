@@ -11,10 +11,15 @@ from collections import namedtuple
 SensorEvent = namedtuple('SensorEvent', ['sensor_id', 'ts', 'val'])
 
 """
+from collections import OrderedDict
 import datetime
 import csv as csvlib
+import io
+import itertools
 import logging
+import os
 import os.path
+import threading
 logger = logging.getLogger(__name__)
 
 from thingflow.base import InputThing, OutputThing, FatalError, \
@@ -29,92 +34,444 @@ class EventSpreadsheetMapping(EventRowMapping):
         """
         raise NotImplemented
 
+    def event_to_line(self, event):
+        """Optionally format the event directly as a line of csv text,
+        including the line terminator. Return None (the default) to have
+        the writer format event_to_row(event) with the csv module instead.
+        """
+        return None
+
+
+def _parse_sensor_id(sensor_id):
+    try:
+        return int(sensor_id)
+    except ValueError:
+        return sensor_id # does ot necessarily have to be an int
+
+# Types that the csv writer formats as their repr()
+_NUMBER_TYPES = (int, float)
+# Characters that cause the csv writer to quote a field
+_QUOTED_CHARS = frozenset(',"\r\n')
 
-    
 class SensorEventMapping(EventSpreadsheetMapping):
     """A maping that works for SensorEvent tuples. We map the time
     values twice - as the raw timestamp and as an iso-formatted datetime.
+
+    Consecutive events frequently have the same timestamp (e.g. several
+    sensors sampled together), so we remember the last timestamp and its
+    iso string. The pair is stored as one tuple so that a mapper shared
+    between threads never sees a timestamp paired with the wrong string.
+
+    If emit_iso is False, the datetime column is left out. Rows are about a
+    third smaller and we don't need to format a datetime for each event, at
+    the cost of a file that is less readable by people.
     """
+    # Class level defaults, so that subclasses whose __init__() does not
+    # call ours still work.
+    emit_iso = True
+    _last_iso = (None, None)
+    # column indexes of the timestamp, sensor id, and value
+    _columns = (0, 2, 3)
+
+    def __init__(self, emit_iso=True):
+        if not emit_iso:
+            self.emit_iso = False
+            self._columns = (0, 1, 2)
+            # Pick the methods once rather than checking emit_iso per event.
+            # Methods overridden by a subclass are left alone.
+            cls = type(self)
+            if cls.event_to_row is SensorEventMapping.event_to_row:
+                self.event_to_row = self._event_to_compact_row
+            if cls.event_to_line is SensorEventMapping.event_to_line:
+                self.event_to_line = self._event_to_compact_line
+
+    def _ts_to_iso(self, ts):
+        (last_ts, iso) = self._last_iso
+        if ts!=last_ts:
+            iso = datetime.datetime.utcfromtimestamp(ts).isoformat()
+            self._last_iso = (ts, iso)
+        return iso
+
     def get_header_row(self):
-        return ['timestamp', 'datetime', 'sensor_id', 'value']
+        if self.emit_iso:
+            return ['timestamp', 'datetime', 'sensor_id', 'value']
+        else:
+            return ['timestamp', 'sensor_id', 'value']
 
     def event_to_row(self, event):
-        return [event.ts,
-                datetime.datetime.utcfromtimestamp(event.ts).isoformat(),
-                event.sensor_id,
-                event.val]
+        # A tuple is cheaper to build than a list and the csv writer
+        # accepts either.
+        return (event.ts, self._ts_to_iso(event.ts), event.sensor_id,
+                event.val)
+
+    def _event_to_compact_row(self, event):
+        return (event.ts, event.sensor_id, event.val)
+
+    def event_to_line(self, event):
+        """Format the common case of a numeric timestamp and value with
+        an int or plain string sensor id without going through the csv
+        writer. The result is the same text the csv writer would produce.
+        Anything else returns None and is left to the csv writer.
+        """
+        ts = event.ts
+        sensor_id = event.sensor_id
+        val = event.val
+        if type(ts) in _NUMBER_TYPES and type(val) in _NUMBER_TYPES and \
+           (type(sensor_id) is int or
+            (type(sensor_id) is str and _QUOTED_CHARS.isdisjoint(sensor_id))):
+            return '%r,%s,%s,%r\r\n' % (ts, self._ts_to_iso(ts), sensor_id, val)
+        else:
+            return None
+
+    def _event_to_compact_line(self, event):
+        ts = event.ts
+        sensor_id = event.sensor_id
+        val = event.val
+        if type(ts) in _NUMBER_TYPES and type(val) in _NUMBER_TYPES and \
+           (type(sensor_id) is int or
+            (type(sensor_id) is str and _QUOTED_CHARS.isdisjoint(sensor_id))):
+            return '%r,%s,%r\r\n' % (ts, sensor_id, val)
+        else:
+            return None
 
     def row_to_event(self, row):
-        ts = float(row[0])
-        try:
-            sensor_id = int(row[2])
-        except ValueError:
-            sensor_id = row[2] # does ot necessarily have to be an int
-        val = float(row[3])
-        return SensorEvent(ts=ts, sensor_id=sensor_id, val=val)
+        (ts_col, id_col, val_col) = self._columns
+        return SensorEvent(ts=float(row[ts_col]),
+                           sensor_id=_parse_sensor_id(row[id_col]),
+                           val=float(row[val_col]))
     
 default_event_mapper = SensorEventMapping()
 
 
-class CsvWriter(OutputThing, InputThing):
-    def __init__(self, previous_in_chain, filename,
-                 mapper=default_event_mapper):
+class CompactSensorEventMapping(SensorEventMapping):
+    """A SensorEventMapping that leaves out the iso-formatted datetime
+    column. Equivalent to SensorEventMapping(emit_iso=False).
+    """
+    def __init__(self):
+        super().__init__(emit_iso=False)
+
+compact_event_mapper = CompactSensorEventMapping()
+
+# The readers can parse files written by these mappings without going
+# through the mapping (see _read_sensor_events_fast() and
+# _scan_sensor_events()). We don't include subclasses, which may have
+# changed the row format.
+_SENSOR_EVENT_MAPPINGS = (SensorEventMapping, CompactSensorEventMapping)
+
+
+# Number of rows we collect before writing them to the file
+DEFAULT_BATCH_SIZE = 256
+# Size of the file buffer for the writers. This is larger than Python's
+# default so that the OS sees fewer, larger writes.
+DEFAULT_BUFFER_SIZE = 65536
+# Number of daily files a RollingCsvWriter keeps open at once
+DEFAULT_MAX_OPEN_FILES = 4
+
+def _line_formatter(mapper):
+    """Return the mapper's event_to_line() method, or None if the writer
+    should use event_to_row() instead. A subclass that overrides
+    event_to_row() or get_header_row() but inherits event_to_line() has
+    changed the row format, so the inherited method must not be used.
+    """
+    if type(mapper) in _SENSOR_EVENT_MAPPINGS:
+        return mapper.event_to_line
+    for cls in type(mapper).__mro__:
+        attrs = vars(cls)
+        if 'event_to_line' in attrs:
+            return mapper.event_to_line
+        if 'event_to_row' in attrs or 'get_header_row' in attrs:
+            return None
+    return None
+
+def _format_row(row):
+    """Return the row as a line of csv text, formatted the same way that
+    the csv writer would write it to a file.
+    """
+    buf = io.StringIO()
+    csvlib.writer(buf).writerow(row)
+    return buf.getvalue()
+
+def _sync_and_close(f):
+    """Flush any buffered rows to the OS, ask the OS to persist them, and
+    then close the file.
+    """
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+class _LineBuffer(list):
+    """A list of formatted csv lines. Since it has a write() method, a csv
+    writer can format rows directly into it.
+    """
+    write = list.append
+
+
+class _BatchingCsvWriter(OutputThing, InputThing):
+    """Common functionality for the csv writers. Each event is formatted as
+    a line of csv text and added to a batch. The batch is written to the
+    file when it reaches batch_size lines, when the file is flushed, and
+    when the file is closed. If flush_every is greater than zero, we also
+    flush the file after that many rows, which bounds how much data a crash
+    can lose.
+
+    If the mapper's class defines an event_to_line() method (see
+    _line_formatter()), we use it to format events directly. We fall back to
+    event_to_row() and the csv writer when it returns None.
+
+    Files are opened in binary mode with a buffer of buffer_size bytes. The
+    batch is encoded to UTF-8 once, when it is written, rather than having
+    a text wrapper encode each write.
+    """
+    def __init__(self, mapper, flush_every, batch_size, buffer_size):
         super().__init__()
-        self.filename = filename
         self.mapper = mapper
-        self.file = open(filename, 'w', newline='')
-        self.writer = csvlib.writer(self.file)
-        self.writer.writerow(self.mapper.get_header_row())
-        self.file.flush()
+        self.flush_every = flush_every
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.rows_since_flush = 0
+        self.file = None
+        self._lines = _LineBuffer()
+        self.writer = csvlib.writer(self._lines)
+        # bind the methods used for each event up front
+        self._add_line = self._lines.append
+        self._writerow = self.writer.writerow
+        self._to_row = mapper.event_to_row
+        self._to_line = _line_formatter(mapper)
+        # Pick the per-event code at construction: for our own SensorEvent
+        # mappings without periodic flushing, we can skip the checks in
+        # _add_event().
+        if type(mapper) in _SENSOR_EVENT_MAPPINGS and not flush_every:
+            self._add_event = self._add_sensor_event
+
+    def _write_batch(self):
+        if self._lines:
+            self.file.write(''.join(self._lines).encode('utf-8'))
+            self._lines.clear()
+
+    def _add_event(self, x):
+        line = self._to_line(x) if self._to_line is not None else None
+        if line is None:
+            self._writerow(self._to_row(x))
+        else:
+            self._add_line(line)
+        if len(self._lines)>=self.batch_size:
+            self._write_batch()
+        if self.flush_every:
+            self.rows_since_flush += 1
+            if self.rows_since_flush>=self.flush_every:
+                self._write_batch()
+                self.file.flush()
+                self.rows_since_flush = 0
+
+    def _add_sensor_event(self, x):
+        line = self._to_line(x)
+        if line is None:
+            self._writerow(self._to_row(x))
+        else:
+            self._add_line(line)
+        if len(self._lines)>=self.batch_size:
+            self._write_batch()
+
+    def _close_file(self):
+        if self.file:
+            self._write_batch()
+            _sync_and_close(self.file)
+
+
+class CsvWriter(_BatchingCsvWriter):
+    """Write an event stream to a csv file. See _BatchingCsvWriter for
+    how rows are batched and flushed.
+    """
+    def __init__(self, previous_in_chain, filename,
+                 mapper=default_event_mapper, flush_every=0,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(mapper, flush_every, batch_size, buffer_size)
+        self.filename = filename
+        self.file = open(filename, 'wb', buffering=buffer_size)
+        header = _format_row(self.mapper.get_header_row())
+        self.file.write(header.encode('utf-8'))
         self.dispose = previous_in_chain.connect(self)
 
     def on_next(self, x):
-        self.writer.writerow(self.mapper.event_to_row(x))
-        self.file.flush()
+        self._add_event(x)
         self._dispatch_next(x)
 
     def on_completed(self):
-        self.file.close()
+        self._close_file()
         self._dispatch_completed()
 
     def on_error(self, e):
-        self.file.close()
+        self._close_file()
         self._dispatch_error(e)
 
     def __str__(self):
         return 'csv_writer(%s)' % self.filename
 
 @filtermethod(OutputThing)
-def csv_writer(this, filename, mapper=default_event_mapper):
+def csv_writer(this, filename, mapper=default_event_mapper, flush_every=0,
+               batch_size=DEFAULT_BATCH_SIZE, buffer_size=DEFAULT_BUFFER_SIZE,
+               emit_iso=True):
     """Write an event stream to a csv file. mapper is an
-    instance of EventSpreadsheetMapping.
+    instance of EventSpreadsheetMapping. The default mapper writes the
+    timestamp twice: as a number and as an iso-formatted datetime. If the
+    file size or write rate matters more than human readability, pass
+    emit_iso=False (or use compact_event_mapper), which leaves out the
+    datetime column. Rows are written in batches of batch_size. If
+    flush_every is non-zero, the file is flushed after that
+    many rows. buffer_size is the size of the file's buffer in bytes.
     """
-    return CsvWriter(this, filename, mapper)
+    if not emit_iso:
+        if mapper is default_event_mapper:
+            mapper = compact_event_mapper
+        elif getattr(mapper, 'emit_iso', True):
+            raise FatalError("csv_writer: emit_iso=False is only supported "
+                             "with a SensorEventMapping that has emit_iso "
+                             "False, got mapper %s" % mapper)
+    return CsvWriter(this, filename, mapper, flush_every=flush_every,
+                     batch_size=batch_size, buffer_size=buffer_size)
+
+# (day number since the epoch, date) for the last call to
+# default_get_date_from_event()
+_last_event_date = (None, None)
 
 def default_get_date_from_event(event):
-    return datetime.datetime.utcfromtimestamp(event.ts).date()
+    """Return the (UTC) date of the event's timestamp. Events usually arrive
+    in time order, so we only build a new date when the day changes.
+    """
+    global _last_event_date
+    day = event.ts // 86400
+    (last_day, event_date) = _last_event_date
+    if day!=last_day:
+        event_date = datetime.datetime.utcfromtimestamp(event.ts).date()
+        _last_event_date = (day, event_date)
+    return event_date
+
+class _SharedCsvFile:
+    """An open csv file in a CsvFileRegistry. Writers hold the lock while
+    writing a batch, so batches from different writers never interleave.
+    """
+    def __init__(self, path, file):
+        self.path = path
+        self.file = file
+        self.lock = threading.Lock()
+        self.refcount = 0
+
+
+class CsvFileRegistry:
+    """Open csv files, keyed by path, that are shared between writers. If
+    several RollingCsvWriters write to the same files (e.g. one per sensor,
+    all using the same base name), they share a single file object and
+    buffer rather than each opening the file. A file is closed when the
+    last writer releases it.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+
+    def acquire(self, path, header_line, buffer_size=DEFAULT_BUFFER_SIZE):
+        """Return the shared file for path, opening it if needed. If we
+        create the file, header_line (bytes) is written as its first line.
+        """
+        with self._lock:
+            entry = self._files.get(path)
+            if entry is None:
+                entry = _SharedCsvFile(path,
+                                       _open_csv_file(path, header_line,
+                                                      buffer_size))
+                self._files[path] = entry
+            entry.refcount += 1
+            return entry
+
+    def release(self, path, sync=False):
+        """Give up a reference to the file. The last release closes the
+        file, after asking the OS to persist it if sync is True.
+        """
+        with self._lock:
+            entry = self._files[path]
+            entry.refcount -= 1
+            if entry.refcount>0:
+                return
+            del self._files[path]
+        with entry.lock:
+            if sync:
+                _sync_and_close(entry.file)
+            else:
+                entry.file.close()
+
+    def __len__(self):
+        return len(self._files)
+
+# The registry used by RollingCsvWriter unless another one is provided
+csv_file_registry = CsvFileRegistry()
+
+def _open_csv_file(filename, header_line, buffer_size):
+    """Open filename for appending in binary mode. If the file does not
+    already exist, write header_line to it.
+    """
+    # Create the file only if it does not already exist. This tells us
+    # whether we need a header row without a separate existence check.
+    try:
+        fd = os.open(filename, os.O_WRONLY|os.O_CREAT|os.O_EXCL, 0o644)
+    except FileExistsError:
+        # don't write header row for existing file
+        return open(filename, 'ab', buffering=buffer_size)
+    f = os.fdopen(fd, 'wb', buffering=buffer_size)
+    f.write(header_line)
+    return f
 
-class RollingCsvWriter(OutputThing, InputThing):
+
+class RollingCsvWriter(_BatchingCsvWriter):
     """Write an event stream to csv files, rolling to a new file
     daily. The filename is basename-yyyy-mm-dd.cvv. Typically,
     basename is the sensor id.
     If sub_port is specified, the writer will subscribe to the specified port
     in the previous filter, rather than the default port. This is helpful
     when connecting to a dispatcher.
+    Rows are written in batches of batch_size. If flush_every is non-zero,
+    the current file is flushed after that many rows. Otherwise, rows stay
+    buffered until the file is rolled or closed.
+
+    Events may arrive a little out of order (e.g. late events from a device
+    that buffers its samples). To avoid closing and reopening files around
+    the day boundary, we keep the most recently used max_open_files files
+    open. The least recently used file is closed when we need to open
+    another one.
+
+    Open files are obtained from registry (by default, the module's
+    csv_file_registry), so writers using the same directory and base name
+    share their files. Each batch is written while holding the file's lock.
     """
     def __init__(self, previous_in_chain, directory,
                  base_name,
                  mapper=default_event_mapper,
                  get_date=default_get_date_from_event,
-                 sub_port=None):
-        super().__init__()
+                 sub_port=None, flush_every=0,
+                 batch_size=DEFAULT_BATCH_SIZE,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 max_open_files=DEFAULT_MAX_OPEN_FILES,
+                 registry=csv_file_registry):
+        super().__init__(mapper, flush_every, batch_size, buffer_size)
+        self.registry = registry
         self.directory = directory
         self.base_name = base_name
-        self.mapper = mapper
+        # the directory and base name part of the filename does not change
+        self._path_prefix = os.path.join(directory, base_name) + '-'
+        self.filename = None # the file currently being written
         self.get_date = get_date
+        # the header is written each time we create a file, so format it once
+        self._header_line = \
+            _format_row(self.mapper.get_header_row()).encode('utf-8')
         self.current_file_date = None
-        self.file = None
-        self.writer = None
+        # When using the default get_date, we key files by UTC day number
+        # rather than date and only build a date when we open a file.
+        self._use_day_index = get_date is default_get_date_from_event
+        self.current_key = None
+        # map from day key to (shared file, date), least recently used first
+        self.max_open_files = max_open_files
+        self._open_files = OrderedDict()
+        self._file_lock = None # lock of the current shared file
         if sub_port is None:
             self.dispose = previous_in_chain.connect(self)
         else:
@@ -122,40 +479,73 @@ class RollingCsvWriter(OutputThing, InputThing):
                                                        port_mapping=(sub_port, 'default'))
 
     def _start_file(self, event_date):
-        filename = os.path.join(self.directory,
-                                self.base_name +
-                                ('-%d-%02d-%02d.csv' %
-                                 (event_date.year, event_date.month,
-                                  event_date.day)))
-        if os.path.exists(filename):
-            self.file = open(filename, 'a', newline='')
-            self.writer = csvlib.writer(self.file)
-            # don't write header row for existing file
-        else:
-            self.file = open(filename, 'w', newline='')
-            self.writer = csvlib.writer(self.file)
-            self.writer.writerow(self.mapper.get_header_row())
-        self.file.flush()
+        filename = '%s%04d-%02d-%02d.csv' % \
+                   (self._path_prefix, event_date.year, event_date.month,
+                    event_date.day)
+        entry = self.registry.acquire(filename, self._header_line,
+                                      self.buffer_size)
+        self._use_entry(entry, event_date)
+        return entry
+
+    def _use_entry(self, entry, event_date):
+        self.file = entry.file
+        self._file_lock = entry.lock
+        self.filename = entry.path
         self.current_file_date = event_date
-        
+
+    def _write_batch(self):
+        if self._lines:
+            with self._file_lock:
+                self.file.write(''.join(self._lines).encode('utf-8'))
+            self._lines.clear()
+
+    def _switch_file(self, key, x):
+        """Make the file for the specified day key current, opening it if
+        it is not already open. x is the event that caused the switch.
+        """
+        if self.file:
+            # rows from the previous day must go to the previous file
+            self._write_batch()
+            if self.flush_every:
+                self.file.flush()
+                self.rows_since_flush = 0
+        entry = self._open_files.get(key)
+        if entry is not None:
+            self._open_files.move_to_end(key)
+            self._use_entry(*entry)
+        else:
+            if len(self._open_files)>=self.max_open_files:
+                (_, (old_entry, _)) = self._open_files.popitem(last=False)
+                self.registry.release(old_entry.path)
+            if self._use_day_index:
+                event_date = datetime.datetime.utcfromtimestamp(x.ts).date()
+            else:
+                event_date = key
+            entry = self._start_file(event_date)
+            self._open_files[key] = (entry, event_date)
+        self.current_key = key
+
+    def _close_file(self):
+        if self.file:
+            self._write_batch()
+        for (entry, _) in self._open_files.values():
+            self.registry.release(entry.path, sync=True)
+        self._open_files.clear()
+        self.file = None
+
     def on_next(self, x):
-        event_date = self.get_date(x)
-        if event_date!=self.current_file_date:
-            if self.file:
-                self.file.close()
-            self._start_file(event_date)
-        self.writer.writerow(self.mapper.event_to_row(x))
-        self.file.flush()
+        key = x.ts // 86400 if self._use_day_index else self.get_date(x)
+        if key!=self.current_key:
+            self._switch_file(key, x)
+        self._add_event(x)
         self._dispatch_next(x)
 
     def on_completed(self):
-        if self.file:
-            self.file.close()
+        self._close_file()
         self._dispatch_completed()
 
     def on_error(self, e):
-        if self.file:
-            self.file.close()
+        self._close_file()
         self._dispatch_error(e)
 
     def __str__(self):
@@ -164,26 +554,224 @@ class RollingCsvWriter(OutputThing, InputThing):
 
 @filtermethod(OutputThing)
 def rolling_csv_writer(this, directory, basename, mapper=default_event_mapper,
-                            get_date=default_get_date_from_event, sub_port=None):
+                       get_date=default_get_date_from_event, sub_port=None,
+                       flush_every=0, batch_size=DEFAULT_BATCH_SIZE,
+                       buffer_size=DEFAULT_BUFFER_SIZE,
+                       max_open_files=DEFAULT_MAX_OPEN_FILES):
     """Write an event stream to csv files, rolling to a new file
     daily. The filename is basename-yyyy-mm-dd.cvv. Typically,
     basename is the sensor id.
     If sub_port is specified, the writer will subscribe to the specified port
     in the previous filter, rather than the default port. This is helpful
     when connecting to a dispatcher.
+    Rows are written in batches of batch_size. If flush_every is non-zero,
+    the file is flushed after that many rows. buffer_size is the size of
+    the file's buffer in bytes. Up to max_open_files of the most recently
+    used daily files are kept open, so that late events do not cause files
+    to be repeatedly closed and reopened.
     """
     return RollingCsvWriter(this, directory, basename, mapper=mapper,
-                            get_date=get_date, sub_port=sub_port)
+                            get_date=get_date, sub_port=sub_port,
+                            flush_every=flush_every, batch_size=batch_size,
+                            buffer_size=buffer_size,
+                            max_open_files=max_open_files)
+
+
+# Number of events held in the column buffers of a BufferedCsvWriter
+DEFAULT_COLUMN_BUFFER_EVENTS = 4096
+
+class BufferedCsvWriter(OutputThing, InputThing):
+    """Write a SensorEvent stream to a csv file, buffering the events in
+    column order: one numpy array each for the timestamps, sensor ids, and
+    values. When the buffer is full, the whole block is formatted at once
+    using numpy.savetxt(). Events from any number of sensors can go to
+    the same writer (and file).
+
+    This requires numpy. The mapper must be default_event_mapper or
+    compact_event_mapper (or another instance of those classes) and
+    sensor ids must be integers. Floats are formatted with 17 significant
+    digits, which round trips but is not always the shortest
+    representation. The datetime column always includes microseconds.
+    """
+    def __init__(self, previous_in_chain, filename,
+                 mapper=default_event_mapper,
+                 buffer_events=DEFAULT_COLUMN_BUFFER_EVENTS,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        import numpy # optional dependency, only needed for this writer
+        if type(mapper) not in _SENSOR_EVENT_MAPPINGS:
+            raise FatalError("BufferedCsvWriter does not support mapper %s" %
+                             mapper)
+        super().__init__()
+        self._np = numpy
+        self.filename = filename
+        self.mapper = mapper
+        self._with_iso = mapper.emit_iso
+        self.buffer_events = buffer_events
+        self._ts = numpy.empty(buffer_events, 'f8')
+        self._sensor_ids = numpy.empty(buffer_events, 'i8')
+        self._vals = numpy.empty(buffer_events, 'f8')
+        self._count = 0
+        self._fmt = '%.17g,%s,%d,%.17g' if self._with_iso else '%.17g,%d,%.17g'
+        self.file = open(filename, 'w', newline='', buffering=buffer_size)
+        self.file.write(_format_row(mapper.get_header_row()))
+        self.dispose = previous_in_chain.connect(self)
+
+    def _write_columns(self):
+        n = self._count
+        if n==0:
+            return
+        np = self._np
+        ts = self._ts[:n]
+        if self._with_iso:
+            dts = (ts*1e6).round().astype('int64').astype('datetime64[us]')
+            columns = [ts, np.datetime_as_string(dts, unit='us'),
+                       self._sensor_ids[:n], self._vals[:n]]
+        else:
+            columns = [ts, self._sensor_ids[:n], self._vals[:n]]
+        np.savetxt(self.file, np.rec.fromarrays(columns), fmt=self._fmt,
+                   newline='\r\n')
+        self._count = 0
+
+    def on_next(self, x):
+        i = self._count
+        self._ts[i] = x.ts
+        self._sensor_ids[i] = x.sensor_id
+        self._vals[i] = x.val
+        self._count = i + 1
+        if self._count==self.buffer_events:
+            self._write_columns()
+        self._dispatch_next(x)
+
+    def on_completed(self):
+        self._write_columns()
+        _sync_and_close(self.file)
+        self._dispatch_completed()
+
+    def on_error(self, e):
+        self._write_columns()
+        _sync_and_close(self.file)
+        self._dispatch_error(e)
+
+    def __str__(self):
+        return 'buffered_csv_writer(%s)' % self.filename
+
+@filtermethod(OutputThing)
+def buffered_csv_writer(this, filename, mapper=default_event_mapper,
+                        buffer_events=DEFAULT_COLUMN_BUFFER_EVENTS,
+                        buffer_size=DEFAULT_BUFFER_SIZE):
+    """Write a SensorEvent stream with integer sensor ids to a csv file,
+    formatting blocks of buffer_events events at a time with numpy. See
+    BufferedCsvWriter for details.
+    """
+    return BufferedCsvWriter(this, filename, mapper=mapper,
+                             buffer_events=buffer_events,
+                             buffer_size=buffer_size)
+
+
+class _EventsAsRows(EventRowMapping):
+    """Mapping for a reader whose "rows" are already events.
+    """
+    def row_to_event(self, row):
+        return row
+
+
+def _read_sensor_events_fast(filename, mapper):
+    """Parse a csv file written using one of the _SENSOR_EVENT_MAPPINGS
+    with pandas. The file is memory mapped and parsed all at once by
+    pandas' C parser rather than a row at a time. Returns a list of
+    SensorEvents, or None if pandas is not installed.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        return None
+    # Read every field as a string, without NaN for empty fields, so that
+    # the values are converted exactly as SensorEventMapping.row_to_event()
+    # would do it. Otherwise pandas would infer the type of the sensor id
+    # column (e.g. ids like "1.5" or "True").
+    df = pd.read_csv(filename, usecols=list(mapper._columns), engine='c',
+                     memory_map=True, dtype=str, keep_default_na=False)
+    columns = (df.iloc[:, 0].tolist(), df.iloc[:, 1].tolist(),
+               df.iloc[:, 2].tolist())
+    return [SensorEvent(ts=float(ts), sensor_id=_parse_sensor_id(sensor_id),
+                        val=float(val))
+            for (ts, sensor_id, val) in zip(*columns)]
+
+
+# Number of characters read at a time by _scan_sensor_events()
+SCAN_CHUNK_SIZE = 1 << 20
+
+def _scan_sensor_events(f, mapper=default_event_mapper,
+                        chunk_size=SCAN_CHUNK_SIZE):
+    """Generator that parses the rows of a csv file written using one of the
+    _SENSOR_EVENT_MAPPINGS, returning SensorEvents. Rather than running the
+    csv module's parser over every character, we read large chunks, split
+    them into lines, and split each line at the commas. The datetime column
+    (if any) is not parsed.
+
+    This only works if no fields are quoted. If we see a quote character,
+    we hand the rest of the file to the csv module.
+    """
+    (ts_col, id_col, val_col) = mapper._columns
+    leftover = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        text = leftover + chunk
+        if '"' in text:
+            # The chunk may end part way through a line. Finish that line
+            # before handing off, as the csv module treats the end of each
+            # line it is given as the end of a record.
+            text += f.readline()
+            rows = csvlib.reader(itertools.chain(io.StringIO(text, newline=''),
+                                                 f))
+            for row in rows:
+                yield mapper.row_to_event(row)
+            return
+        lines = text.split('\n')
+        leftover = lines.pop() # partial line, finished by the next chunk
+        for line in lines:
+            fields = line.split(',', val_col)
+            yield SensorEvent(ts=float(fields[ts_col]),
+                              sensor_id=_parse_sensor_id(fields[id_col]),
+                              val=float(fields[val_col]))
+    if leftover: # last line did not have a line terminator
+        fields = leftover.split(',', val_col)
+        yield SensorEvent(ts=float(fields[ts_col]),
+                          sensor_id=_parse_sensor_id(fields[id_col]),
+                          val=float(fields[val_col]))
 
 
 class CsvReader(DirectReader):
     def __init__(self, filename, mapper=default_event_mapper,
-                 has_header_row=True):
+                 has_header_row=True, fast=False):
         """Creates a output_thing that reads a row at a time from a csv file
         and converts the rows into events using the specified mapping.
+
+        If fast is True, mapper is one of the _SENSOR_EVENT_MAPPINGS, the
+        file has a header row, and pandas is installed, we parse the whole
+        file up front with pandas. This uses more memory, as every event is
+        created before the first is dispatched. Without pandas, fast is
+        ignored.
+
+        Otherwise, if the mapper is one of the _SENSOR_EVENT_MAPPINGS, we
+        use a simple scanner that splits lines at commas rather than the csv
+        module's parser (see _scan_sensor_events()).
         """
         self.filename = filename
-        self.file = open(filename, 'r', newline='')
+        self.file = None
+        events = None
+        if fast and has_header_row and type(mapper) in _SENSOR_EVENT_MAPPINGS:
+            events = _read_sensor_events_fast(filename, mapper)
+            if events is None:
+                logger.debug("pandas not available, reading %s a row at a time",
+                             filename)
+        if events is not None:
+            super().__init__(iter(events), _EventsAsRows(),
+                             name='CsvReader(%s)'%filename)
+            return
+        self.file = open(filename, 'r', newline='', encoding='utf-8')
         reader = csvlib.reader(self.file)
         if has_header_row:
             # swallow up the header row so it is not passed as data
@@ -192,7 +780,13 @@ class CsvReader(DirectReader):
                 logger.debug("header row of %s: %s", filename, ', '.join(header_row))
             except:
                 raise FatalError("Problem in reading header row of csv file %s" % filename)
-        super().__init__(reader, mapper, name='CsvReader(%s)'%filename)
+        if type(mapper) in _SENSOR_EVENT_MAPPINGS:
+            super().__init__(_scan_sensor_events(self.file, mapper),
+                             _EventsAsRows(),
+                             name='CsvReader(%s)'%filename)
+        else:
+            super().__init__(reader, mapper, name='CsvReader(%s)'%filename)
 
     def _close(self):
-        self.file.close()
+        if self.file:
+            self.file.close()
@@ -11,7 +11,7 @@ class EventRowMapping:
     """
     def event_to_row(self, event):
         """Convert an event to the row representation (usually a
-        list of values).
+        list or tuple of values).
         """
         raise NotImplemented
 
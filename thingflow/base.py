@@ -30,10 +30,14 @@ The key abstractions are:
 See the README.rst file for more details.
 """
 
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+import functools
+import operator
+import sys
 import threading
 import time
-import queue
 import traceback as tb
 import logging
 logger = logging.getLogger(__name__)
@@ -77,6 +81,20 @@ def _on_completed_name(port):
     else:
         return 'on_%s_completed' % port
 
+# map from port to its (on_next, on_completed, on_error) method names
+_PORT_METHOD_NAMES = {}
+
+def _method_names(port):
+    """Return the (on_next, on_completed, on_error) method names for the
+    port. The names are formatted once per port and then cached.
+    """
+    names = _PORT_METHOD_NAMES.get(port)
+    if names is None:
+        names = (_on_next_name(port), _on_completed_name(port),
+                 _on_error_name(port))
+        _PORT_METHOD_NAMES[port] = names
+    return names
+
 
 class CallableAsInputThing:
     """Wrap any callable with the InputThing interface.
@@ -85,25 +103,34 @@ class CallableAsInputThing:
     """
     def __init__(self, on_next=None, on_error=None, on_completed=None,
                  port=None):
-        setattr(self, _on_next_name(port), on_next or noop)
+        (on_next_name, on_completed_name, on_error_name) = _method_names(port)
+        setattr(self, on_next_name, on_next or noop)
         if on_error:
-            setattr(self, _on_error_name(port), on_error)
+            setattr(self, on_error_name, on_error)
+        elif on_error_name!='on_error':
+            # for the default port, the class's on_error is used directly
+            setattr(self, on_error_name, self.on_error)
+        setattr(self, on_completed_name, on_completed or noop)
+
+    def on_error(self, err):
+        """The default error handler: re-raise fatal errors and log others.
+        """
+        if isinstance(err, FatalError):
+            raise err.with_traceback(err.__traceback__)
         else:
-            def default_error(err):
-                if isinstance(err, FatalError):
-                    raise err.with_traceback(err.__traceback__)
-                else:
-                    logger.error("%s: Received on_error(%s)" %
-                                 (self, err))
-            setattr(self, _on_error_name(port), default_error)
-        setattr(self, _on_completed_name(port), on_completed or noop)
+            logger.error("%s: Received on_error(%s)", self, err)
         
     def __str__(self):
         return 'CallableAsInputThing(%s)' % str(self.on_next)
 
     def __repr__(self):
+        on_error = self.on_error
+        if getattr(on_error, '__self__', None) is self:
+            # the default handler - a bound method's repr would include
+            # our own repr
+            on_error = on_error.__func__
         return 'CallableAsInputThing(on_next=%s, on_error=%s, on_completed=%s)' % \
-            (repr(self.on_next), repr(self.on_error), repr(self.on_completed))
+            (repr(self.on_next), repr(on_error), repr(self.on_completed))
 
 
 class FatalError(Exception):
@@ -136,10 +163,10 @@ class ExcInDispatch(FatalError):
 # fields are not needed at runtime, but helpful in debugging.
 # We use a class with slots instead of a named tuple because we want to
 # change the values of the on_next, etc. functions when tracing (tuples
-# are read-only. The attribute access of a named tuple by name is no
-# faster than slots. If we need to spead this up at some point, use a
-# named tuple but access via the index values (at a cost to readability
-# of the code).
+# are read-only). The attribute access of a named tuple by name is no
+# faster than slots. For busy OutputThings, the on_next attribute is only
+# read when generating the dispatch code (see OutputThing._compile_dispatch),
+# not for each event.
 class _Connection:
     __slots__ = ('on_next', 'on_completed', 'on_error', 'input_thing',
                  'input_port')
@@ -160,6 +187,55 @@ class _Connection:
         return '_Connection(%s,%s)' % \
              (str(self.input_thing), str(self.input_port))
 
+
+# Consumes an iterator without keeping its values. Used by _dispatch_next()
+# to run a map() over the connections.
+_consume = deque(maxlen=0).extend
+
+# Number of events an OutputThing dispatches, with no change to its connections,
+# before we generate specialized dispatch code. See
+# OutputThing._compile_dispatch().
+DISPATCH_COMPILE_THRESHOLD = 1000
+
+# Messages for the ExcInDispatch errors raised by the _dispatch methods
+_DISPATCH_NEXT_ERROR_MSG = \
+    "Unexpected exception when dispatching event '%s' to InputThing %s from OutputThing %s"
+_DISPATCH_COMPLETED_ERROR_MSG = \
+    "Unexpected exception when dispatching completed to InputThing %s from OutputThing %s"
+_DISPATCH_ERROR_ERROR_MSG = \
+    "Unexpected exception when dispatching error '%s' to InputThing %s from OutputThing %s"
+
+# Code generated by OutputThing._compile_dispatch() for each connection
+_DISPATCH_NEXT_TEMPLATE = """\
+        try:
+            on_next_%(i)d(x)
+        except Exception as e:
+            if isinstance(e, FatalError):
+                raise
+            raise ExcInDispatch(msg %% (repr(x), input_thing_%(i)d,
+                                        output_thing)) from e
+"""
+
+def _single_dispatch_next(output_thing, connection):
+    """Return a function that dispatches events from the OutputThing to its
+    only connection. Used instead of a generated function when there is
+    just one connection.
+    """
+    on_next = connection.on_next
+    input_thing = connection.input_thing
+    def dispatch_next(x):
+        try:
+            on_next(x)
+        except Exception as e:
+            if isinstance(e, FatalError):
+                raise
+            raise ExcInDispatch(_DISPATCH_NEXT_ERROR_MSG %
+                                (repr(x), input_thing, output_thing)) from e
+    return dispatch_next
+
+# The ports of an OutputThing created without a list of ports
+_DEFAULT_PORTS = frozenset(('default',))
+
     
 class OutputThing:
     """Base class for event generators (output things). The non-underscore
@@ -167,15 +243,64 @@ class OutputThing:
     underscores are for interactions with the scheduler.
     """
     def __init__(self, ports=None):
-        self.__connections__ = {} # map from port to InputThing set
         if ports is None:
-            self.__ports__ = set(['default',])
+            # Most OutputThings just have the default port, so they share
+            # one (immutable) port set. _close_port() replaces rather than
+            # changes the set.
+            self.__ports__ = _DEFAULT_PORTS
+            # map from port to tuple of connections
+            self.__connections__ = {'default': ()}
         else:
-            self.__ports__ = set(ports)
-        for port in self.__ports__:
-            self.__connections__[port] = []
+            self.__ports__ = frozenset(ports)
+            self.__connections__ = dict.fromkeys(self.__ports__, ())
+        # Most events go to the default port, so we keep its connection
+        # list in an attribute as well. This is None if there is no
+        # default port or it has been closed.
+        self._default_connections = self.__connections__.get('default')
         self.__enqueue_fn__ = None
-        self.__closed_ports__ = []
+        self.__closed_ports__ = set()
+        # map from port to a function that calls on_next() for
+        # each of the port's connections, see _set_connections() and
+        # _compile_dispatch()
+        self._fast_next = {}
+        # map from port to a tuple of its connections' on_next methods
+        self._next_fns = {}
+        # map from port to the number of dispatches since its connections
+        # last changed
+        self._hot = {}
+        # held while replacing a port's connections in connect()/disconnect()
+        self._connections_lock = threading.Lock()
+
+    def _set_connections(self, port, connections):
+        """Replace the tuple of connections for the port. Always use this
+        rather than assigning to __connections__ directly, so that
+        _default_connections, _next_fns, and _fast_next stay in sync.
+        """
+        self.__connections__[port] = connections
+        self._next_fns[port] = tuple(c.on_next for c in connections)
+        if port=='default':
+            self._default_connections = connections
+        if len(connections)==1:
+            # The common case of a single connection does not need any
+            # warmup or code generation.
+            self._fast_next[port] = _single_dispatch_next(self, connections[0])
+        else:
+            self._fast_next.pop(port, None)
+        self._hot.pop(port, None)
+
+    def _get_connections(self, port):
+        """Return the connections for a port other than the default,
+        raising an error if the port is unknown or closed.
+        """
+        connections = self.__connections__.get(port)
+        if connections is None:
+            if port in self.__closed_ports__:
+                raise PortAlreadyClosed("Port '%s' on OutputThing %s already had an on_completed or on_error_event" %
+                                         (port, self))
+            else:
+                raise UnknownPortError("Unknown port '%s' in OutputThing %s" %
+                                        (port, self))
+        return connections
 
 
     def connect(self, input_thing, port_mapping=None):
@@ -194,49 +319,53 @@ class OutputThing:
             raise InvalidPortError("Invalid publish port '%s', valid ports are %s" %
                                     (output_port,
                                      ', '.join([str(s) for s in self.__ports__])))
-        if not hasattr(input_thing, _on_next_name(input_port)) and callable(input_thing):
+        (on_next_name, on_completed_name, on_error_name) = \
+            _method_names(input_port)
+        if not hasattr(input_thing, on_next_name) and callable(input_thing):
                 input_thing = CallableAsInputThing(input_thing, port=input_port)
         try:
-            connection = \
-                _Connection(on_next=getattr(input_thing, _on_next_name(input_port)),
-                              on_completed=getattr(input_thing, _on_completed_name(input_port)),
-                              on_error=getattr(input_thing, _on_error_name(input_port)),
-                              input_thing=input_thing,
-                              input_port=input_port)
+            (on_next, on_completed, on_error) = \
+                operator.attrgetter(on_next_name, on_completed_name,
+                                    on_error_name)(input_thing)
         except AttributeError:
             raise InvalidPortError("Invalid input port '%s', missing method(s) on InputThing %s" %
                                     (input_port, input_thing))
-        new_connections = self.__connections__[output_port].copy()
-        new_connections.append(connection)
-        self.__connections__[output_port] = new_connections
+        connection = _Connection(on_next=on_next, on_completed=on_completed,
+                                 on_error=on_error, input_thing=input_thing,
+                                 input_port=input_port)
+        # The connections for a port are an immutable tuple. We replace the
+        # whole tuple on each change, so a _dispatch method iterating over
+        # the old tuple is not affected.
+        with self._connections_lock:
+            self._set_connections(output_port,
+                                  self.__connections__[output_port] +
+                                  (connection,))
         def disconnect():
-            # To remove the connection, we replace the entire list with a copy
+            # To remove the connection, we replace the entire tuple with one
             # that is missing the connection. This allows disconnect() to be
-            # called within a _dispatch method. Otherwise, we get an error if
-            # we attempt to change the list of connections while iterating over
-            # it.
-            new_connections = self.__connections__[output_port].copy()
-            #new_connections.remove(connection)
-            # we look for a connection to the same port and thing rather than
-            # the same object - the object may have changed due to tracing
-            found = False
-            for c in self.__connections__[output_port]:
-                if c.input_thing==input_thing and c.input_port==input_port:
-                    new_connections.remove(c)
-                    found = True
-                    break
-            assert found
-            self.__connections__[output_port] = new_connections
+            # called within a _dispatch method.
+            with self._connections_lock:
+                connections = self.__connections__[output_port]
+                # we look for a connection to the same port and thing rather
+                # than the same object - the object may have changed due to
+                # tracing
+                for (i, c) in enumerate(connections):
+                    if c.input_thing==input_thing and c.input_port==input_port:
+                        break
+                else:
+                    raise AssertionError("Connection to %s not found" %
+                                         input_thing)
+                self._set_connections(output_port,
+                                      connections[:i] + connections[i+1:])
         return disconnect
 
     def _has_connections(self):
         """Used by the scheduler to see the thing has any more outgoing connections.
         If a scheduled thing no longer has output connections, it is descheduled.
         """
-        for (port, conns) in self.__connections__.items():
-            if len(conns)>0:
-                return True
-        return False
+        # the connections for each port are a tuple, which is true if
+        # non-empty
+        return any(self.__connections__.values())
     
     def _schedule(self, enqueue_fn):
         """This method is used by the scheduler to specify an enqueue function
@@ -253,49 +382,97 @@ class OutputThing:
         """
         #print("Closing port %s on %s" % (port, self)) # XXX
         del self.__connections__[port]
-        self.__ports__.remove(port)
-        self.__closed_ports__.append(port)
+        if port=='default':
+            self._default_connections = None
+        self._next_fns.pop(port, None)
+        self._fast_next.pop(port, None)
+        self._hot.pop(port, None)
+        self.__ports__ = self.__ports__ - frozenset((port,))
+        self.__closed_ports__.add(port)
+
+    def _compile_dispatch(self, port):
+        """Generate a function that dispatches an event to each of the
+        port's current connections and save it in _fast_next. The
+        connections' on_next methods are bound to local (closure) variables
+        of the generated code, so a dispatch does not need to iterate over
+        the connections or look up their attributes. The function is
+        discarded when the port's connections change.
+
+        Generating the code is only worthwhile for long-running streams, so
+        _dispatch_next() calls this after DISPATCH_COMPILE_THRESHOLD events
+        with the same connections.
+
+        The code is generated without holding _connections_lock. If the
+        connections change in the meantime, the new function is not saved,
+        as it would dispatch to the old connections.
+        """
+        with self._connections_lock:
+            connections = self.__connections__[port]
+            next_fns = self._next_fns[port]
+        params = []
+        body = []
+        env = {'FatalError': FatalError, 'ExcInDispatch': ExcInDispatch,
+               'msg': _DISPATCH_NEXT_ERROR_MSG}
+        for (i, c) in enumerate(connections):
+            params.extend(['on_next_%d' % i, 'input_thing_%d' % i])
+            body.append(_DISPATCH_NEXT_TEMPLATE % {'i':i})
+        src = 'def make(output_thing, %s):\n' % ', '.join(params) + \
+              '    def dispatch_next(x):\n' + ''.join(body) + \
+              '    return dispatch_next\n'
+        exec(compile(src, '<dispatch_next(%s)>' % port, 'exec'), env)
+        args = []
+        for (on_next, c) in zip(next_fns, connections):
+            args.extend([on_next, c.input_thing])
+        fn = env['make'](self, *args)
+        with self._connections_lock:
+            # the tuple of connections is replaced on every change
+            if self.__connections__.get(port) is connections:
+                self._fast_next[port] = fn
+        return fn
 
     def _dispatch_next(self, x, port=None):
         #print("Dispatch next called on %s, port %s, msg %s" % (self, port, str(x)))
-        if port==None:
+        if port is None or port=='default':
             port = 'default'
-        try:
-            connections = self.__connections__[port]
-        except KeyError as e:
-            if port in self.__closed_ports__:
-                raise PortAlreadyClosed("Port '%s' on OutputThing %s already had an on_completed or on_error_event" %
-                                         (port, self))
-            else:
-                raise UnknownPortError("Unknown port '%s' in OutputThing %s" %
-                                        (port, self)) from e
+            connections = self._default_connections
+            if connections is None:
+                connections = self._get_connections(port)
+        else:
+            connections = self._get_connections(port)
         if len(connections) == 0:
             return
         enq = self.__enqueue_fn__
         if enq:
-            for s in connections:
-                enq(s.on_next, x)
+            # calls enq(on_next, x) for each connection, looping in C
+            _consume(map(enq, self._next_fns[port], repeat(x)))
         else:
+            dispatch = self._fast_next.get(port)
+            if dispatch is not None:
+                dispatch(x)
+                return
+            hot = self._hot.get(port, 0) + 1
+            if hot>=DISPATCH_COMPILE_THRESHOLD:
+                self._hot.pop(port, None)
+                self._compile_dispatch(port)
+            else:
+                self._hot[port] = hot
             try:
                 for s in connections:
                     s.on_next(x)
-            except FatalError:
-                raise
             except Exception as e:
-                raise ExcInDispatch("Unexpected exception when dispatching event '%s' to InputThing %s from OutputThing %s" %
+                if isinstance(e, FatalError):
+                    raise
+                raise ExcInDispatch(_DISPATCH_NEXT_ERROR_MSG %
                                     (repr(x), s.input_thing, self)) from e
 
     def _dispatch_completed(self, port=None):
-        if port==None:
+        if port is None or port=='default':
             port = 'default'
-        try:
-            connections = self.__connections__[port]
-        except KeyError as e:
-            if port in self.__closed_ports__:
-                raise PortAlreadyClosed("Port '%s' on OutputThing %s already had an on_completed or on_error_event" %
-                                         (port, self))
-            else:
-                raise UnknownPortError("Unknown port '%s' in OutputThing %s" % (port, self)) from e
+            connections = self._default_connections
+            if connections is None:
+                connections = self._get_connections(port)
+        else:
+            connections = self._get_connections(port)
         enq = self.__enqueue_fn__
         if enq:
             for s in connections:
@@ -304,24 +481,21 @@ class OutputThing:
             try:
                 for s in connections:
                     s.on_completed()
-            except FatalError:
-                raise
             except Exception as e:
-                raise ExcInDispatch("Unexpected exception when dispatching completed to InputThing %s from OutputThing %s" %
+                if isinstance(e, FatalError):
+                    raise
+                raise ExcInDispatch(_DISPATCH_COMPLETED_ERROR_MSG %
                                     (s.input_thing, self)) from e
         self._close_port(port)
 
     def _dispatch_error(self, e, port=None):
-        if port==None:
+        if port is None or port=='default':
             port = 'default'
-        try:
-            connections = self.__connections__[port]
-        except KeyError as e:
-            if port in self.__closed_ports__:
-                raise PortAlreadyClosed("Port '%s' on OutputThing %s already had an on_completed or on_error_event" %
-                                         (port, self))
-            else:
-                raise UnknownPortError("Unknown port '%s' in OutputThing %s" % (port, self)) from e
+            connections = self._default_connections
+            if connections is None:
+                connections = self._get_connections(port)
+        else:
+            connections = self._get_connections(port)
         enq = self.__enqueue_fn__
         if enq:
             for s in connections:
@@ -330,11 +504,11 @@ class OutputThing:
             try:
                 for s in connections:
                     s.on_error(e)
-            except FatalError:
-                raise
-            except Exception as e:
-                raise ExcInDispatch("Unexpected exception when dispatching error '%s' to InputThing %s from OutputThing %s" %
-                                    (repr(e), s.input_thing, self)) from e
+            except Exception as exc:
+                if isinstance(exc, FatalError):
+                    raise
+                raise ExcInDispatch(_DISPATCH_ERROR_ERROR_MSG %
+                                    (repr(e), s.input_thing, self)) from exc
         self._close_port(port)
 
     def print_downstream(self):
@@ -359,9 +533,10 @@ class OutputThing:
                                    connection.input_thing)
             else:
                 print(current_seq)
-        print("***** Dump of all paths from %s *****" % self.__str__())
-        print_from("  " + self.__str__(), self)
-        print("*"*(12+len(self.__str__())))
+        name = str(self)
+        print("***** Dump of all paths from %s *****" % name)
+        print_from("  " + name, self)
+        print("*"*(12+len(name)))
 
     def trace_downstream(self):
         """Install wrappers that print a trace message for each
@@ -414,8 +589,9 @@ class OutputThing:
                         connections_for_port.append(make_trace_connection(thing,
                                                                           port,
                                                                           connection))
-                    new_connections[port] = connections_for_port
-                thing.__connections__ = new_connections
+                    new_connections[port] = tuple(connections_for_port)
+                for (port, connections) in new_connections.items():
+                    thing._set_connections(port, connections)
         trace_from(self)
         print("***** installed tracing in all paths starting from %s" %
               str(self))
@@ -424,9 +600,9 @@ class OutputThing:
         """pretty print the set of connections"""
         h1 = "***** InputThings for %s *****" % self
         print(h1)
-        for port in sorted(self.__connections__.keys()):
+        for (port, connections) in sorted(self.__connections__.items()):
             print("  Port %s" % port)
-            for s in self.__connections__[port]:
+            for s in connections:
                 print("    [%s] => %s" % (s.input_port, s.input_thing))
                 print("      on_next: %s" % s.on_next)
                 print("      on_completed: %s" % s.on_completed)
@@ -548,20 +724,30 @@ class FunctionFilter(Filter):
                  on_error=None, name=None):
         """name is an option name to be used in __str__() calls.
         """
-        super().__init__(previous_in_chain)
         self._on_next = on_next
         self._on_error = on_error
         self._on_completed = on_completed
+        # Pick the on_next implementation here, rather than checking for a
+        # function on each event. This must happen before we connect
+        # upstream, as connect() looks up on_next. Subclasses that override
+        # on_next() keep their method.
+        if type(self).on_next is FunctionFilter.on_next:
+            self.on_next = self._call_on_next if on_next \
+                           else self._dispatch_next
+        super().__init__(previous_in_chain)
         if name:
             self.name = name
 
     def on_next(self, x):
+        if self._on_next:
+            self._call_on_next(x)
+        else:
+            self._dispatch_next(x)
+
+    def _call_on_next(self, x):
         try:
-            if self._on_next:
-                # we pass in an extra "self" since this is a function, not a method
-                self._on_next(self, x)
-            else:
-                self._dispatch_next(x)
+            # we pass in an extra "self" since this is a function, not a method
+            self._on_next(self, x)
         except FatalError:
             raise
         except Exception as e:
@@ -645,7 +831,9 @@ def filtermethod(base, alias=None):
 
     1. A method with the specified name is added to the specified class
        (usually the OutputThing base class). This is for the fluent (method
-       chaining) API.
+       chaining) API. The method is set once on the class, when the
+       decorator runs, so creating an OutputThing does not bind any
+       per-instance methods.
     2. A function is created in the local namespace for use in the functional API.
        This function does not take the OutputThing as an argument. Instead,
        it takes the remaining arguments and then returns a function which,
@@ -717,30 +905,49 @@ class IterableAsOutputThing(OutputThing, DirectOutputThingMixin):
     """Convert any interable to an OutputThing. This can be
     used with the schedule_recurring() and schedule_periodic()
     methods of the scheduler.
+
+    Each call to _observe() dispatches up to batch_size events. For a fast,
+    in-memory iterable, a larger batch size means fewer trips through the
+    event loop.
     """
-    def __init__(self, iterable, name=None):
+    def __init__(self, iterable, name=None, batch_size=1):
         super().__init__()
         self.iterable = iterable
         self.name = name
+        self.batch_size = batch_size
     
     def _observe(self):
-        try:
-            event = self.iterable.__next__()
-        except StopIteration:
-            self._close()
-            self._dispatch_completed()
-        except FatalError:
-            self._close()
-            raise
-        except Exception as e:
-            # If the iterable throws an exception, we treat it as non-fatal.
-            # The error is dispatched downstream and the connection closed.
-            # If other sensors are running, things will continue.
-            tb.print_exc()
-            self._close()
-            self._dispatch_error(e)
-        else:
-            self._dispatch_next(event)
+        # Bound once per call, as subclasses may replace self.iterable. If it
+        # is not an iterator, next() raises the TypeError inside the loop,
+        # where it is dispatched as an error like any other.
+        iterable = self.iterable
+        next_event = getattr(iterable, '__next__', None) or \
+                     functools.partial(next, iterable)
+        dispatch_next = self._dispatch_next
+        has_connections = self._has_connections
+        for _ in range(self.batch_size):
+            try:
+                event = next_event()
+            except StopIteration:
+                self._close()
+                self._dispatch_completed()
+                return
+            except FatalError:
+                self._close()
+                raise
+            except Exception as e:
+                # If the iterable throws an exception, we treat it as non-fatal.
+                # The error is dispatched downstream and the connection closed.
+                # If other sensors are running, things will continue.
+                tb.print_exc()
+                self._close()
+                self._dispatch_error(e)
+                return
+            dispatch_next(event)
+            # Stop pulling events once everything downstream has
+            # disconnected (e.g. a take() that got its last event).
+            if not has_connections():
+                return
 
     def _close(self):
         """This method is called when we stop the iteration, either due to
@@ -756,11 +963,11 @@ class IterableAsOutputThing(OutputThing, DirectOutputThingMixin):
         else:
             return super().__str__()
            
-def from_iterable(i):
-    return IterableAsOutputThing(i)
+def from_iterable(i, batch_size=1):
+    return IterableAsOutputThing(i, batch_size=batch_size)
 
-def from_list(l):
-    return IterableAsOutputThing(iter(l))
+def from_list(l, batch_size=1):
+    return IterableAsOutputThing(iter(l), batch_size=batch_size)
 
 # XXX Move this out of base.py
 class FunctionIteratorAsOutputThing(OutputThing, DirectOutputThingMixin):
@@ -778,48 +985,65 @@ class FunctionIteratorAsOutputThing(OutputThing, DirectOutputThingMixin):
         result_selector: Selector function for results produced in the sequence.
 
         Returns the generated sequence.
+
+    Each call to _observe() produces up to batch_size elements.
     """
 
-    def __init__(self, initial_state, condition, iterate, result_selector):
+    def __init__(self, initial_state, condition, iterate, result_selector,
+                 batch_size=1):
         super().__init__()
         self.value = initial_state
         self.condition = condition
         self.iterate = iterate
         self.result_selector = result_selector 
         self.first = True
+        self.batch_size = batch_size
 
     def _observe(self):
+        condition = self.condition
+        iterate = self.iterate
+        result_selector = self.result_selector
+        dispatch_next = self._dispatch_next
+        has_connections = self._has_connections
         try:
-            if self.first: # first time: just send the value
-                self.first = False
-                if self.condition(self.value):
-                    r = self.result_selector(self.value)
-                    self._dispatch_next(r)
-                else:
-                    self._dispatch_completed()
-            else:
-                if self.condition(self.value):
-                    self.value = self.iterate(self.value)
-                    r = self.result_selector(self.value)
-                    self._dispatch_next(r)
-                else: 
-                    self._dispatch_completed()
+            for _ in range(self.batch_size):
+                if self.first: # first time: just send the value
+                    self.first = False
+                    if condition(self.value):
+                        dispatch_next(result_selector(self.value))
+                        if not has_connections():
+                            return
+                        continue
+                elif condition(self.value):
+                    self.value = iterate(self.value)
+                    dispatch_next(result_selector(self.value))
+                    # don't compute more values once everything downstream
+                    # has disconnected (e.g. a take() that is done)
+                    if not has_connections():
+                        return
+                    continue
+                self._dispatch_completed()
+                return
         except Exception as e:
             self._dispatch_error(e)
 
-def from_func(init, cond, iter, selector):
-    return FunctionIteratorAsOutputThing(init, cond, iter, selector)
+def from_func(init, cond, iter, selector, batch_size=1):
+    return FunctionIteratorAsOutputThing(init, cond, iter, selector,
+                                         batch_size=batch_size)
 
 
 
 # Define a default sensor event as a tuple of sensor id, timestamp, and value.
 SensorEvent = namedtuple('SensorEvent', ['sensor_id', 'ts', 'val'])
 
+# Builds the tuple directly, skipping the keyword argument handling of
+# SensorEvent(). Fields are (sensor_id, ts, val).
+_make_sensor_event = SensorEvent._make
+
 def make_sensor_event(sensor, sample):
     """Given a sensor object and a sample taken from that sensor,
     return a SensorEvent tuple."""
-    return SensorEvent(sensor_id=sensor.sensor_id, ts=time.time(),
-                       val=sample)
+    return _make_sensor_event((sensor.sensor_id, time.time(), sample))
 
 
 class SensorAsOutputThing(OutputThing, DirectOutputThingMixin):
@@ -852,6 +1076,11 @@ class SensorAsOutputThing(OutputThing, DirectOutputThingMixin):
         return 'SensorAsOutputThing(%s)' % repr(self.sensor)
 
 
+# Tags for the actions queued by BlockingInputThing
+_NEXT = 0
+_COMPLETED = 1
+_ERROR = 2
+
 class BlockingInputThing:
     """This implements a InputThing which may potential block when sending an
     event outside the system. The InputThing is run on a separate thread. We
@@ -872,19 +1101,23 @@ class BlockingInputThing:
         self.num_closed_ports = 0
         # create local proxy methods for each port
         for port in self.ports:
-            setattr(self, _on_next_name(port),
-                    lambda x: self.__queue__.put((self._on_next, False,
-                                                     [port, x]),))
-            setattr(self, _on_completed_name(port),
-                    lambda: self.__queue__.put((self._on_completed, True,
-                                                [port]),))
-            setattr(self, _on_error_name(port),
-                    lambda e: self.__queue__.put((self._on_error, True,
-                                                  [port, e]),))
-        self.__queue__ = queue.Queue()
+            (on_next_name, on_completed_name, on_error_name) = \
+                _method_names(port)
+            setattr(self, on_next_name,
+                    functools.partial(self._put_next, port))
+            setattr(self, on_completed_name,
+                    functools.partial(self._put_completed, port))
+            setattr(self, on_error_name,
+                    functools.partial(self._put_error, port))
+        # Requests for the blocking thread. Appending to and popping from a
+        # deque are atomic, so we only need the event to wake up the thread
+        # when the deque is empty. This is cheaper than a queue.Queue, which
+        # takes a lock and signals a condition for every put and get.
+        self.__queue__ = deque()
+        self.__wake__ = threading.Event()
         self.scheduler = scheduler
         self.thread = _ThreadForBlockingInputThing(self, scheduler)
-        self.scheduler.active_schedules[self] = self.request_stop
+        self.scheduler.active_schedules[self] = _StopThunk(self.request_stop)
         def start():
             self.thread.start()
         self.scheduler.event_loop.call_soon(start)
@@ -896,27 +1129,68 @@ class BlockingInputThing:
         """
         if self.thread==None:
             return # no thread to stop
-        self.__queue__.put(None) # special stop token
+        self._put(None) # special stop token
+
+    def _put(self, action):
+        """Queue an action for the blocking thread. Can be called from any
+        thread. An action is a (tag, port, argument) tuple, where the tag is
+        one of _NEXT, _COMPLETED, or _ERROR.
+        """
+        self.__queue__.append(action)
+        self.__wake__.set()
+
+    # The port proxies. We bind the port with functools.partial rather than
+    # a lambda, so there is no extra Python frame per event.
+    def _put_next(self, port, x):
+        self.__queue__.append((_NEXT, port, x))
+        self.__wake__.set()
+
+    def _put_completed(self, port):
+        self.__queue__.append((_COMPLETED, port, None))
+        self.__wake__.set()
+
+    def _put_error(self, port, e):
+        self.__queue__.append((_ERROR, port, e))
+        self.__wake__.set()
+
+    def _get(self):
+        """Wait for the next action. Called in the blocking thread.
+        """
+        queue = self.__queue__
+        while True:
+            try:
+                return queue.popleft()
+            except IndexError:
+                pass
+            # Every append is followed by a set(). We clear the event before
+            # retrying popleft(), so any action whose set() we cleared is
+            # already in the deque.
+            self.__wake__.wait()
+            self.__wake__.clear()
 
     def _wait_and_dispatch(self):
         """Called by main loop of blocking thread to block for a request
         and then dispatch it. Returns True if it processed a normal request
         and False if it got a stop message or there is no more events possible.
         """
-        action = self.__queue__.get()
-        if action is not None:
-            (method, closing_port, args) = action
-            method(*args)
-            if closing_port:
-                self.num_closed_ports += 1
-                if self.num_closed_ports==len(self.ports):
-                    # no more ports can receive events, treat this
-                    # as a stop.
-                    print("Stopping blocking InputThing %s" % self)
-                    return False
-            return True # more work possible
-        else:
+        action = self._get()
+        if action is None:
             return False # stop requested
+        (tag, port, arg) = action
+        if tag==_NEXT:
+            self._on_next(port, arg)
+            return True
+        elif tag==_COMPLETED:
+            self._on_completed(port)
+        else:
+            self._on_error(port, arg)
+        self.num_closed_ports += 1
+        if self.num_closed_ports==len(self.ports):
+            # no more ports can receive events, treat this
+            # as a stop.
+            logger.debug("Stopping blocking InputThing %s", self)
+            return False
+        return True # more work possible
         
         
     def _on_next(self, port, x):
@@ -972,35 +1246,67 @@ class _ThreadForBlockingInputThing(threading.Thread):
                 
 
 
+def _run_calls(calls):
+    """Run a batch of (fn, args) calls queued by another thread.
+    """
+    for (fn, args) in calls:
+        fn(*args)
+
+
 class _ThreadForBlockingOutputThing(threading.Thread):
     """Background thread for OutputThings that might block.
+
+    The calls that the OutputThing enqueues for the main event loop during
+    an _observe() call are collected and then handed to the event loop
+    together. This wakes up the event loop once per _observe() call rather
+    than once per call.
     """
     def __init__(self, output_thing, interval, scheduler):
         self.output_thing = output_thing
         self.interval = interval
         self.scheduler = scheduler
-        self.stop_requested = False
+        # set to request a stop. Waiting on it between _observe() calls,
+        # rather than sleeping, lets a stop take effect immediately.
+        self._stop_event = threading.Event()
+        self._pending_calls = []
         super().__init__()
 
     def _stop_loop(self):
-        self.stop_requested = True
+        self._stop_event.set()
+
+    def _enqueue(self, fn, *args):
+        self._pending_calls.append((fn, args))
+
+    def _flush(self):
+        if self._pending_calls:
+            calls = self._pending_calls
+            self._pending_calls = []
+            self.scheduler.event_loop.call_soon_threadsafe(_run_calls, calls)
 
     def run(self):
-        def enqueue_fn(fn, *args):
-            self.scheduler.event_loop.call_soon_threadsafe(fn, *args)
-        self.output_thing._schedule(enqueue_fn=enqueue_fn)
+        self.output_thing._schedule(enqueue_fn=self._enqueue)
             
         try:
-            while True:
-                if self.stop_requested:
-                    break
-                start = time.time()
-                self.output_thing._observe()
-                if self.output_thing._has_connections():
+            # We pace the calls against a deadline on the monotonic clock,
+            # which does not jump when the system time is adjusted. If an
+            # _observe() call overruns the interval, we start the next one
+            # right away and reset the deadline, rather than trying to catch
+            # up with a burst of calls.
+            stop_event = self._stop_event
+            deadline = time.monotonic()
+            while not stop_event.is_set():
+                try:
+                    self.output_thing._observe()
+                finally:
+                    self._flush()
+                if not self.output_thing._has_connections():
                     break
-                time_left = self.interval - (time.time() - start)
-                if time_left > 0 and (not self.stop_requested):
-                    time.sleep(time_left)
+                deadline += self.interval
+                time_left = deadline - time.monotonic()
+                if time_left > 0:
+                    stop_event.wait(time_left)
+                else:
+                    deadline -= time_left
         except Exception as e:
             msg = "_observe for %s exited with error" % self.output_thing
             logger.exception(msg)
@@ -1018,15 +1324,93 @@ class ScheduleError(FatalError):
     pass
 
 
+class _StopThunk:
+    """Wraps the stop function of a schedule that does not have an event loop
+    handle, so that every value in Scheduler.active_schedules can be stopped
+    by calling its cancel() method.
+    """
+    __slots__ = ('cancel',)
+    def __init__(self, cancel):
+        self.cancel = cancel
+
+
+# Number of worker threads for private event loops when the scheduler
+# does not limit them (see Scheduler.schedule_on_private_event_loop()).
+# The pool only starts a thread when no idle one is available.
+_UNLIMITED_PRIVATE_LOOPS = sys.maxsize
+
+
+class _PeriodicTick:
+    """The event loop callback for schedule_periodic() and
+    schedule_recurring(). Each call observes the OutputThing and, if it
+    still has connections, uses rearm(self) to get the handle for the next
+    tick. A slotted object rather than a closure keeps these lookups to
+    plain attribute loads.
+    """
+    __slots__ = ('output_thing', 'scheduler', 'rearm')
+    def __init__(self, output_thing, scheduler, rearm):
+        self.output_thing = output_thing
+        self.scheduler = scheduler
+        self.rearm = rearm
+
+    def __call__(self):
+        output_thing = self.output_thing
+        output_thing._observe()
+        scheduler = self.scheduler
+        active_schedules = scheduler.active_schedules
+        if output_thing not in active_schedules:
+            return # canceled by the _observe() call
+        if output_thing._has_connections():
+            active_schedules[output_thing] = self.rearm(self)
+            output_thing._schedule(enqueue_fn=None)
+        else:
+            scheduler._remove_from_active_schedules(output_thing)
+
+
+class _OneTimeTick:
+    """The event loop callback for schedule_later_one_time().
+    """
+    __slots__ = ('output_thing', 'scheduler')
+    def __init__(self, output_thing, scheduler):
+        self.output_thing = output_thing
+        self.scheduler = scheduler
+
+    def __call__(self):
+        output_thing = self.output_thing
+        assert output_thing in self.scheduler.active_schedules
+        # Remove from the active schedules since this was a one-time schedule.
+        # Note that the _observe() call could potentially reschedule the
+        # OutputThing through another call to the scheduler.
+        self.scheduler._remove_from_active_schedules(output_thing)
+        output_thing._observe()
+
+
 class Scheduler:
     """Wrap an asyncio event loop and provide methods for various kinds of
     periodic scheduling.
+
+    If max_private_loops is not None, at most that many private event loops
+    (see schedule_on_private_event_loop()) run at once. Any others wait
+    until a running loop exits.
     """
-    def __init__(self, event_loop):
+    def __init__(self, event_loop, max_private_loops=None):
         self.event_loop = event_loop
-        self.active_schedules = {} # mapping from task to schedule handle
+        # Mapping from task to schedule handle. Each handle has a cancel()
+        # method: it is either an event loop handle or a _StopThunk.
+        # stop() drains this dict in place, so its identity never changes.
+        # Hot paths update it by subscript, which is cheaper than calling a
+        # pre-bound __setitem__ or pop.
+        self.active_schedules = {}
         self.pending_futures = {}
         self.next_future_id = 1
+        # Worker threads for private event loops. The pool is created when
+        # the first loop is started and shut down by stop().
+        self.max_private_loops = max_private_loops
+        self._private_loop_pool = None
+        # Number of private loops currently running. This is updated by the
+        # worker threads, holding _private_loop_lock.
+        self._private_loops = 0
+        self._private_loop_lock = threading.Lock()
         # Set the following to an exception if we are exiting the loop due to
         # an exception. We will then raise a SchedulerError when the event loop
         # exits.
@@ -1044,37 +1428,35 @@ class Scheduler:
         If there are no more active schedules, we will request exiting of
         the event loop. This method must be run from the main thread.
         """
-        del self.active_schedules[output_thing]
-        if len(self.active_schedules)==0:
-            print("No more active schedules, will exit event loop")
+        active_schedules = self.active_schedules
+        del active_schedules[output_thing]
+        if not active_schedules:
+            logger.debug("No more active schedules, will exit event loop")
             self.stop()
 
+    def _cancel_schedule(self, output_thing):
+        """Cancel the event loop handle of an OutputThing scheduled via
+        schedule_periodic(), schedule_recurring(), or schedule_later_one_time().
+        """
+        logger.debug("canceling schedule of %s", output_thing)
+        try:
+            handle = self.active_schedules[output_thing]
+        except KeyError:
+            raise ScheduleError("Attempt to de-schedule OutputThing %s, which does not have an active schedule" %
+                                output_thing)
+        handle.cancel()
+        self._remove_from_active_schedules(output_thing)
+
     def schedule_periodic(self, output_thing, interval):
         """Returns a callable that can be used to remove the OutputThing from the
         scheduler.
         """
-        def cancel():
-            try:
-                handle = self.active_schedules[output_thing]
-            except KeyError:
-                raise ScheduleError("Attempt to de-schedule OutputThing %s, which does not have an active schedule" %
-                                    output_thing)
-            handle.cancel()
-            self._remove_from_active_schedules(output_thing)
-        def run():
-            assert output_thing in self.active_schedules
-            output_thing._observe()
-            more = output_thing._has_connections()
-            if not more and output_thing in self.active_schedules:
-                self._remove_from_active_schedules(output_thing)
-            elif output_thing in self.active_schedules:
-                handle = self.event_loop.call_later(interval, run)
-                self.active_schedules[output_thing] = handle
-                output_thing._schedule(enqueue_fn=None)
-        handle = self.event_loop.call_later(interval, run)
-        self.active_schedules[output_thing] = handle
+        tick = _PeriodicTick(output_thing, self,
+                             functools.partial(self.event_loop.call_later,
+                                               interval))
+        self.active_schedules[output_thing] = tick.rearm(tick)
         output_thing._schedule(enqueue_fn=None)
-        return cancel
+        return functools.partial(self._cancel_schedule, output_thing)
 
     def schedule_sensor(self, sensor, interval, *input_thing_sequence,
                         make_event_fn=make_sensor_event,
@@ -1108,29 +1490,10 @@ class Scheduler:
         Returns a callable that can be used to remove the OutputThing from the
         scheduler.
         """
-        def cancel():
-            print("canceling schedule of %s" % output_thing)
-            try:
-                handle = self.active_schedules[output_thing]
-            except KeyError:
-                raise ScheduleError("Attempt to de-schedule OutputThing %s, which does not have an active schedule" %
-                                    output_thing)
-            handle.cancel()
-            self._remove_from_active_schedules(output_thing)
-        def run():
-            assert output_thing in self.active_schedules
-            output_thing._observe()
-            more = output_thing._has_connections()
-            if not more and output_thing in self.active_schedules:
-                self._remove_from_active_schedules(output_thing)
-            elif output_thing in self.active_schedules:
-                handle = self.event_loop.call_soon(run)
-                self.active_schedules[output_thing] = handle
-                output_thing._schedule(enqueue_fn=None)
-        handle = self.event_loop.call_soon(run)
-        self.active_schedules[output_thing] = handle
+        tick = _PeriodicTick(output_thing, self, self.event_loop.call_soon)
+        self.active_schedules[output_thing] = tick.rearm(tick)
         output_thing._schedule(enqueue_fn=None)
-        return cancel
+        return functools.partial(self._cancel_schedule, output_thing)
 
     def schedule_on_main_event_loop(self, output_thing):
         """Schedule an OutputThing that runs on the main event loop.
@@ -1142,7 +1505,7 @@ class Scheduler:
             # processing any messages, it MUST call
             # _remove_from_active_schedules() on the scheduler.
             output_thing._stop_loop()
-        self.active_schedules[output_thing] = stop
+        self.active_schedules[output_thing] = _StopThunk(stop)
         self.event_loop.call_soon(output_thing._observe_event_loop)
         return stop
     
@@ -1151,10 +1514,16 @@ class Scheduler:
         The OutputThing is assumed to implement EventLoopOutputThingMixin.
         Returns a callable that can be used to unschedule the OutputThing, by
         requesting that the event loop stop.
+
+        The loop runs on a thread from a pool owned by the scheduler.
+        Threads whose loops have exited are reused until stop() is called.
         """
-        def enqueue_fn(fn, *args):
-            self.event_loop.call_soon_threadsafe(fn, *args)
+        # call_soon_threadsafe() already takes (fn, *args), so it can be
+        # used as the enqueue function without a wrapper.
+        enqueue_fn = self.event_loop.call_soon_threadsafe
         def thread_main():
+            with self._private_loop_lock:
+                self._private_loops += 1
             try:
                 output_thing._schedule(enqueue_fn=enqueue_fn)
                 # ok, lets run the event loop
@@ -1162,20 +1531,32 @@ class Scheduler:
             except Exception as e:
                 msg = "Event loop for %s exited with error" % output_thing
                 logger.exception(msg)
-                def die(): # need to stop the scheduler in the main loop
+                exc = e # e is unbound when the except clause ends
+                def done(): # need to stop the scheduler in the main loop
                     del self.active_schedules[output_thing]
-                    raise ScheduleError(msg) from e
-                self.event_loop.call_soon_threadsafe(die)
+                    raise ScheduleError(msg) from exc
             else:
-                def loop_done():
+                def done():
                     self._remove_from_active_schedules(output_thing)
-                self.event_loop.call_soon_threadsafe(loop_done)
-                    
-        t = threading.Thread(target=thread_main)
-        self.active_schedules[output_thing] = output_thing._stop_loop
-        self.event_loop.call_soon(t.start)
+            finally:
+                # We update the count on this thread, as the main event loop
+                # may already have exited. It is done before queuing done(),
+                # so the count is current when the scheduler sees the exit.
+                with self._private_loop_lock:
+                    self._private_loops -= 1
+            self.event_loop.call_soon_threadsafe(done)
+
+        self.active_schedules[output_thing] = \
+            _StopThunk(output_thing._stop_loop)
+        self.event_loop.call_soon(self._start_private_loop, thread_main)
         return output_thing._stop_loop
 
+    def _start_private_loop(self, thread_main):
+        if self._private_loop_pool is None:
+            self._private_loop_pool = ThreadPoolExecutor(
+                max_workers=self.max_private_loops or _UNLIMITED_PRIVATE_LOOPS)
+        self._private_loop_pool.submit(thread_main)
+
     def schedule_periodic_on_separate_thread(self, output_thing, interval):
         """Schedule an OutputThing to run in a separate thread. It should
         implement the DirectOutputThingMixin.
@@ -1183,7 +1564,7 @@ class Scheduler:
         requesting that the child thread stop.
         """
         t = _ThreadForBlockingOutputThing(output_thing, interval, self)
-        self.active_schedules[output_thing] = t._stop_loop
+        self.active_schedules[output_thing] = _StopThunk(t._stop_loop)
         self.event_loop.call_soon(t.start)
         return t._stop_loop
 
@@ -1204,26 +1585,11 @@ class Scheduler:
         return self.schedule_periodic_on_separate_thread(output_thing, interval)
     
     def schedule_later_one_time(self, output_thing, interval):
-        def cancel():
-            print("canceling schedule of %s" % output_thing)
-            try:
-                handle = self.active_schedules[output_thing]
-            except KeyError:
-                raise ScheduleError("Attempt to de-schedule OutputThing %s, which does not have an active schedule" %
-                                    output_thing)
-            handle.cancel()
-            self._remove_from_active_schedules(output_thing)
-        def run():
-            assert output_thing in self.active_schedules
-            # Remove from the active schedules since this was a one-time schedule.
-            # Note that the _observe() call could potentially reschedule the
-            # OutputThing through another call to the scheduler.
-            self._remove_from_active_schedules(output_thing)
-            output_thing._observe()
-        handle = self.event_loop.call_later(interval, run)
+        handle = self.event_loop.call_later(interval,
+                                            _OneTimeTick(output_thing, self))
         self.active_schedules[output_thing] = handle
         output_thing._schedule(enqueue_fn=None)
-        return cancel
+        return functools.partial(self._cancel_schedule, output_thing)
     
     def run_forever(self):
         """Call the event loop's run_forever(). We don't really run forever:
@@ -1234,10 +1600,12 @@ class Scheduler:
             self.event_loop.run_forever()
         except KeyboardInterrupt:
             # If someone hit Control-C to break out of the loop,
-            # they might be trying to diagonose a hang. Print the
+            # they might be trying to diagonose a hang. Log the
             # active OutputThings here before passing on the interrupt.
-            print("Active OutputThings: %s" %
-                  ', '.join([('%s'%o) for o in self.active_schedules.keys()]))
+            # This is a warning so that it is still shown when logging
+            # has not been configured.
+            logger.warning("Active OutputThings: %s",
+                           ', '.join([('%s'%o) for o in self.active_schedules]))
             raise
         if self.fatal_error is not None:
             raise ScheduleError("Scheduler aborted due to fatal error") \
@@ -1265,15 +1633,18 @@ class Scheduler:
         """Stop any active schedules for output things and then call stop() on
         the event loop.
         """
-        for (task, handle) in self.active_schedules.items():
-            #print("Stopping %s" % task)
-            # The handles are either event scheduler handles (with a cancel
-            # method) or just callables to be called directly.
-            if hasattr(handle, 'cancel'):
-                handle.cancel()
-            else:
-                handle()
-        self.active_schedules = {}
+        # Drain the map in place rather than iterating and then replacing it.
+        # This keeps the same dict object and tolerates a stop callable that
+        # removes other entries.
+        active_schedules = self.active_schedules
+        while active_schedules:
+            (task, handle) = active_schedules.popitem()
+            handle.cancel()
+        # Let the idle private loop threads exit. Any loops still running
+        # finish on their threads. A later private loop gets a new pool.
+        if self._private_loop_pool is not None:
+            self._private_loop_pool.shutdown(wait=False)
+            self._private_loop_pool = None
         # go through the pending futures. We don't stop the
         # event loop until all the pending futures have been
         # completed or stopped by their callers.
@@ -1282,7 +1653,7 @@ class Scheduler:
                 # if we still have pending futures, we try the
                 # stop again after the first one we see has
                 # completed.
-                #print("Waiting for future %d (%s)" % (fid, repr(f)))
+                logger.debug("Waiting for future %d (%r)", fid, f)
                 def recheck_stop(f):
                     exc = f.exception()
                     if exc:
@@ -1,5 +1,7 @@
 # Copyright 2016 by MPI-SWS and Data-Ken Research.
 # Licensed under the Apache 2.0 License.
+from collections import deque
+
 from thingflow.base import OutputThing, FunctionFilter, FatalError, filtermethod
 
 class ArgumentOutOfRangeException(FatalError):
@@ -18,16 +20,19 @@ def take_last(this, count):
     Keyword arguments:
     count: The number of elements to take from the end of the sequence
     """
-    q = []
+    if count < 0:
+        raise ArgumentOutOfRangeException()
+
+    # the deque drops its oldest element once it holds count elements
+    q = deque(maxlen=count)
     def on_next(self, x):
         q.append(x)
-        if len(q) > count:
-            q.pop(0)
 
     def on_completed(self):
-        while len(q):
-            v = q.pop(0)
-            self._dispatch_next(v)
+        dispatch_next = self._dispatch_next
+        for v in q:
+            dispatch_next(v)
+        q.clear()
         self._dispatch_completed()
 
     return FunctionFilter(this, on_next=on_next, on_completed=on_completed)
@@ -35,18 +40,19 @@ def take_last(this, count):
 
 @filtermethod(OutputThing)
 def last(this, default=None):
-    value = [default]
-    seen_value = [False]
+    value = default
+    seen_value = False
 
     def on_next(self, x):
-        value[0] = x
-        seen_value[0] = True
+        nonlocal value, seen_value
+        value = x
+        seen_value = True
 
     def on_completed(self):
-        if not seen_value[0] and default is None:
+        if not seen_value and default is None:
             self._dispatch_error(SequenceContainsNoElementsError())
         else:
-            self._dispatch_next(value[0])
+            self._dispatch_next(value)
             self._dispatch_completed()
     return FunctionFilter(this, on_next=on_next, on_completed=on_completed,
                           name='last')
@@ -57,29 +63,36 @@ def take(this, count):
     Keyword arguments:
     count: The number of elements to send forward before skipping the remaining
            elements.
+
+    Each call builds a new filter, even for a count of zero. An OutputThing
+    keeps its connections, so one instance cannot be shared between
+    pipelines. take(0) passes no events and completes on the first upstream
+    event or on upstream completion.
     """
 
     if count < 0:
         raise ArgumentOutOfRangeException()
 
-    remaining = [count]
-    completed = [False]
+    remaining = count
+    completed = False
 
     def on_next(self, value):
-        if remaining[0] > 0:
-            remaining[0] -= 1
+        nonlocal remaining, completed
+        if remaining > 0:
+            remaining -= 1
             self._dispatch_next(value)
-        if remaining[0]==0 and completed[0]==False:
-            completed[0] = True
+        if remaining==0 and completed==False:
+            completed = True
             self.disconnect_from_upstream()
             self._dispatch_completed()
 
     def on_completed(self):
+        nonlocal completed
         # We may have already given a completed notification if we hit count
         # elements. On the other hand, we might still need to provide a notification
         # if the actual sequence length is less than count.
-        if completed[0]==False:
-            completed[0] = True
+        if completed==False:
+            completed = True
             self._dispatch_completed()
 
     return FunctionFilter(this, on_next=on_next, on_completed=on_completed,